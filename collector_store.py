@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import re
+import sqlite3
+import threading
+
+
+class CollectorTable:
+    # NOTE: append-only table, each row is stored as a json document with its own id
+    # Readers can tail the table by rows_after(last_id) without reading the whole history.
+    def __init__(self, store, name):
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', name):
+            raise ValueError(f"Invalid table name '{name}'")
+        self.store = store
+        self.name = name
+        with self.store.lock:
+            self.store.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{name}" ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, unixtime REAL, doc TEXT NOT NULL)')
+            self.store.conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}_unixtime" ON "{name}" (unixtime)')
+
+    def insert(self, document):
+        with self.store.lock:
+            cursor = self.store.conn.execute(
+                f'INSERT INTO "{self.name}" (unixtime, doc) VALUES (?, ?)',
+                (document.get('unixtime'), json.dumps(document)))
+            return cursor.lastrowid
+
+    def insert_multiple(self, documents):
+        with self.store.lock:
+            self.store.conn.execute('BEGIN')
+            # NOTE: commits at the end, or rolls back if a row fails (e.g. a document which is not serializable)
+            with self.store.conn:
+                self.store.conn.executemany(
+                    f'INSERT INTO "{self.name}" (unixtime, doc) VALUES (?, ?)',
+                    ((document.get('unixtime'), json.dumps(document))
+                     for document in documents))
+
+    def _select(self, where='', params=(), order_by='id'):
+        with self.store.lock:
+            rows = self.store.conn.execute(
+                f'SELECT doc FROM "{self.name}" {where} ORDER BY {order_by}',
+                params).fetchall()
+        return [json.loads(doc) for doc, in rows]
+
+    def all(self):
+        return self._select()
+
+    def since(self, unixtime):
+        # NOTE: rows whose unixtime is newer than the given time (uses the unixtime index)
+        return self._select('WHERE unixtime > ?', (unixtime,),
+                            order_by='unixtime, id')
+
+    def between(self, begin, end):
+        # NOTE: rows in [begin, end]
+        return self._select('WHERE unixtime BETWEEN ? AND ?', (begin, end),
+                            order_by='unixtime, id')
+
+    def last_id(self):
+        with self.store.lock:
+            row = self.store.conn.execute(
+                f'SELECT MAX(id) FROM "{self.name}"').fetchone()
+        return row[0] or 0
+
+    def rows_after(self, last_id):
+        # NOTE: returns (rows, new last id)
+        with self.store.lock:
+            rows = self.store.conn.execute(
+                f'SELECT id, doc FROM "{self.name}" WHERE id > ? ORDER BY id',
+                (last_id,)).fetchall()
+        if len(rows) == 0:
+            return [], last_id
+        return [json.loads(doc) for _, doc in rows], rows[-1][0]
+
+    def __len__(self):
+        with self.store.lock:
+            return self.store.conn.execute(
+                f'SELECT COUNT(*) FROM "{self.name}"').fetchone()[0]
+
+
+class CollectorStore:
+    # NOTE: SQLite in WAL mode, an insert appends to the WAL file instead of rewriting the whole db
+    # (TinyDB's JSON storage rewrites the whole file at each insert)
+    def __init__(self, path='collector.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.tables = {}
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = CollectorTable(self, name)
+        return self.tables[name]
+
+    def close(self):
+        self.conn.close()
+
+
+def import_tinydb_json(store, json_filepath):
+    with open(json_filepath) as f:
+        tables = json.load(f)
+    for name, documents in tables.items():
+        rows = [documents[doc_id]
+                for doc_id in sorted(documents, key=int)]
+        store.table(name).insert_multiple(rows)
+        print(f'[📃] imported {len(rows)} rows into {name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--db', default='collector.db')
+    parser.add_argument(
+        '--import-tinydb',
+        help='import a TinyDB json file (e.g. db.json)')
+    parser.add_argument('args', nargs='*')  # any length of args is ok
+
+    args, extra_args = parser.parse_known_args()
+    store = CollectorStore(args.db)
+    if args.import_tinydb:
+        import_tinydb_json(store, args.import_tinydb)
+    for name, in store.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"):
+        print(f'{name}: {len(store.table(name))} rows')
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,26 +3,33 @@
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import asyncio
+import contextlib
 import json
 import os
+import time
 import traceback
 
-import uuid
 import aiofiles
 import streamlit as st
 import streamlit_authenticator as stauth
 import yaml
 import pandas as pd
-from tinydb import TinyDB
-import plotly
-import plotly.subplots
 import plotly.express as px
-import plotly.graph_objects as go
 
-from file_watcher import FileWatcher, FileWatcherConst
+from file_watcher import create_file_watcher, FileWatcherConst
+from data_buffer import ColumnarBuffer
+from data_source import subscribe_data_source
+from decoders import apply_schema
+from collector_store import CollectorStore
+from decl_plan import compile_plan, get_plan
+from rollup import Resample
+from render_scheduler import RenderScheduler
+from export import ExportTarget, MIMES, export_formats, export_compressions, export_file_name
+from live_chart import create_live_chart
+from metrics import METRICS, start_prometheus_file_writer, start_prometheus_server
 import components
 
-db = TinyDB("db.json")
+db = CollectorStore("collector.db")
 
 st.set_page_config(
     page_title="Streamlit Dashboard App",
@@ -46,7 +53,21 @@ async def wait_with_progress_bar(progress_bar, text, interval):
 
 async def update_table_data(table_name, col):
     interval_slider = st.sidebar.slider('update interval[s]', 1, 60, 1)
+    # NOTE: a date range shows the rows in the range (selected by the unixtime index) instead of following the latest rows
+    history = st.sidebar.date_input(f'{table_name} history (empty: latest)', value=[],
+                                    key=f'{table_name}-history')
+    time_range = None
+    if len(history) == 2:
+        tz = ZoneInfo('Asia/Tokyo')
+        time_range = (datetime.combine(history[0], datetime.min.time(), tz).timestamp(),
+                      datetime.combine(history[1], datetime.max.time(), tz).timestamp())
     table = db.table(table_name)
+    buffer = ColumnarBuffer()
+    # NOTE: rollups of the rows for the long ranges (e.g. last 7 days)
+    resample = Resample(y=['memory_percent'])
+    # NOTE: the rowid of the last fetched row, the rows are fetched in the insertion order
+    # (the unixtime may be missing, equal or out of order)
+    last_id = 0
     cnt = 0
     progress_bar = col.progress(0, text='')
     chart = col.empty()
@@ -55,13 +76,26 @@ async def update_table_data(table_name, col):
             cnt, datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3])
         progress_bar.progress(0, text=progress_text)
         try:
-            data = table.all()
-            if len(data) == 0:
-                chart.error(f'Not Found Data: {table_name}')
-            if table_name == 'memory_usage':
-                update_memory_chart(chart, data)
+            # NOTE: fetch only the rows which have not been seen yet
+            if time_range is None:
+                data, last_id = table.rows_after(last_id)
+            elif cnt == 0:
+                data = table.between(*time_range)
             else:
-                st.error(f'TODO: implement for {table_name}')
+                data = []
+            if len(data) > 0:
+                buffer.append_rows(data)
+                resample.extend(pd.DataFrame(data))
+            if len(buffer) == 0:
+                chart.error(f'Not Found Data: {table_name}')
+            elif len(data) > 0:
+                if table_name == 'memory_usage':
+                    df = buffer.to_dataframe()
+                    if len(df.index) > resample.n_out:
+                        df = resample.finalize(df, {})
+                    update_memory_chart(chart, df)
+                else:
+                    st.error(f'TODO: implement for {table_name}')
         except Exception as e:
             error_text = f'🔥 [Exception] update_table_data({table_name})\n{traceback.format_exc()}'
             print(error_text)
@@ -111,13 +145,13 @@ async def load_ls_command():
         cnt += 1
 
 
-def update_memory_chart(container, data):
-    df = pd.DataFrame(data)
-    df['Total'] = df.sum(axis=1)
+def update_memory_chart(container, df):
+    df['Total'] = df.sum(axis=1, numeric_only=True)
     # NOTE: 移動平均線
     df['MA_5'] = df['memory_percent'].rolling(window=5).mean()
-    df['datetime(utc)'] = pd.to_datetime(df['unixtime'], unit='s', utc=True)
-    df['datetime(jst)'] = df['datetime(utc)'].dt.tz_convert('Asia/Tokyo')
+    if 'datetime(jst)' not in df:
+        df['datetime(utc)'] = pd.to_datetime(df['unixtime'], unit='s', utc=True)
+        df['datetime(jst)'] = df['datetime(utc)'].dt.tz_convert('Asia/Tokyo')
     # print(df)
     fig = px.line(
         df,
@@ -127,129 +161,32 @@ def update_memory_chart(container, data):
     container.plotly_chart(fig)
 
 
-def create_top_graph(df):
-    # NOTE: for debugging
-    # st.write(df)
-
-    keys = df['key'].unique()
-    # NOTE: filter meaningful logs
-    df = df[(df['%CPU'] >= '5.0') | (df['%MEM'] >= '1.0')]
-
-    # CPU Usage
-    line_chart_tab, stacked_chart_tab = st.tabs(
-        ["Line Chart", "Stacked Chart"])
-    with line_chart_tab:
-        cpu_fig = px.line(
-            df,
-            x='unixtime',
-            y='%CPU',
-            color='key',
-            markers=True,
-            title='CPU Usage Over Time')
-        st.plotly_chart(cpu_fig)
-
-    with stacked_chart_tab:
-        fig = go.Figure()
-        for key in keys:
-            key_df = df[df['key'] == key]
-            fig.add_trace(go.Scatter(
-                x=key_df['unixtime'],
-                y=key_df['%CPU'], stackgroup="%CPU", mode="lines+markers", name=key))
-        fig.update_layout(title='Stacked Chart',
-                          legend_traceorder='normal',
-                          legend_title_text='key',
-                          xaxis=dict(
-                              title='unixtime',
-                          ),
-                          yaxis=dict(
-                              title='%CPU',
-                          ),
-                          )
-        st.plotly_chart(fig)
-
-    # Memory Usage
-    mem_fig = px.line(
-        df,
-        x='unixtime',
-        y='%MEM',
-        color='key',
-        markers=True,
-        title='Memory Usage Over Time')
-    st.plotly_chart(mem_fig)
-
-
-def create_component(df, decl):
-    # 🌟自動追加のフィールド
-    if 'unixtime' in df:
-        try:
-            df['datetime(utc)'] = pd.to_datetime(
-                df['unixtime'], unit='s', utc=True)
-        except pd._libs.tslibs.np_datetime.OutOfBoundsDatetime as e:
-            df['datetime(utc)'] = pd.to_datetime(
-                df['unixtime'], unit='ms', utc=True)
-            df['unixtime'] = pd.to_datetime(df['unixtime'], unit='ms')
-        df['datetime(jst)'] = df['datetime(utc)'].dt.tz_convert(
-            'Asia/Tokyo')
-    # df['Total'] = df.sum(axis=1)
+def create_component(df, decl, plan=None, data_key=None, stream=None, export=None, live=None,
+                     key=None):
     # NOTE: 移動平均線
     # field名を見て自動追加できると嬉しい
-    title = decl['title'] if 'title' in decl else 'data'
-
-    # dst: optional if None, {src}(MA_{window})
-    def prepro_MA(df, src=None, window=5, dst=None):
-        if not src:
-            print(f"🔥[prepro_MA] Required arg 'src'")
-            return
-        if not dst:
-            dst = f'{src}(MA_{window})'
-        df[dst] = df[src].rolling(window=window).mean()
-    funcs = decl['funcs']
-    fig = None
+    if plan is None:
+        plan = compile_plan(decl)
+    for error in plan.errors:
+        st.error(error)
     try:
-        for func in funcs:
-            func_name = func['name']
-            if func_name == "prepro.MA":
-                prepro_MA(df, **func['args'])
-            elif func_name == "st.write":
-                st.write(df)
-            elif func_name == "st.dataframe":
-                st.dataframe(df, **func["args"])
-            elif func_name == "st.subheader":
-                st.subheader(**func["args"])
-            elif func_name == "st.metric":
-                st.metric(**func["args"])
-            elif func_name == "plotly.subplots.make_subplots":
-                fig = plotly.subplots.make_subplots(**func['args'])
-            elif func_name == "px.line":
-                fig = px.line(df, **func['args'])
-            elif func_name == "px.scatter":
-                fig = px.scatter(df, **func['args'])
-            elif func_name == "update_layout":
-                fig.update_layout(**func["args"])
-            elif func_name == "add_scatter":
-                func["args"]["x"] = df[func["args"]["x"]]
-                func["args"]["y"] = df[func["args"]["y"]]
-                fig.add_scatter(**func["args"])
-            elif func_name == "add_bar":
-                func["args"]["x"] = df[func["args"]["x"]]
-                func["args"]["y"] = df[func["args"]["y"]]
-                fig.add_bar(**func["args"])
-            elif func_name == "top":
-                create_top_graph(df)
-            else:
-                st.error(f"🔥Unknown func.name '{func_name}'")
+        # NOTE: data_df keeps all rows for the download data even if they are downsampled for the plots
+        df, data_df, fig = plan.run(df, data_key, stream)
         if fig:
-            st.plotly_chart(fig)
-        jst_local_time = datetime.now(ZoneInfo("Asia/Tokyo"))
+            with METRICS.time('dashboard_figure_seconds', decl=plan.name):
+                if live is not None:
+                    # NOTE: only the appended points are sent if the figure is already on the client
+                    live.render(plan, df, fig, stream)
+                else:
+                    # NOTE: a component is rendered many times in a script run,
+                    # key is unique per render of the component (e.g. the component key and the render count)
+                    st.plotly_chart(fig, key=key)
+        df = data_df
+        if export is not None:
+            # NOTE: the data is serialized only when the download button is clicked
+            export.update(df)
         if 'index' in df.columns:
-            df.drop(['index'], axis='columns', inplace=True)
-        st.download_button(
-            label="Download data",
-            data=df.to_json(),
-            key=uuid.uuid4(),
-            file_name=f"{jst_local_time.strftime('%Y%m%d_%H%M%S')}-{title}.json",
-            mime="application/json"
-        )
+            df = df.drop(['index'], axis='columns')
         if len(df.index) < 1000:
             with st.expander("data"):
                 st.write(df)
@@ -259,23 +196,53 @@ def create_component(df, decl):
         st.error(error_text)
 
 
+def create_export_controls(export, decl, key):
+    # NOTE: the widgets are created once per script run (not per render) with the stable keys
+    title = decl['title'] if 'title' in decl else 'data'
+    with st.popover("Download data"):
+        fmt = st.selectbox('format', export_formats(), key=f'{key}-export-format')
+        compression = st.selectbox('compression', export_compressions(),
+                                   format_func=lambda value: value or 'none',
+                                   key=f'{key}-export-compression')
+        last_seconds = st.number_input(
+            'last seconds (0: all)', min_value=0, value=0,
+            key=f'{key}-export-last-seconds')
+        jst_local_time = datetime.now(ZoneInfo("Asia/Tokyo"))
+        st.download_button(
+            label="Download",
+            data=lambda: export.export(fmt, compression, last_seconds or None),
+            key=f'{key}-export-download',
+            file_name=export_file_name(
+                f"{jst_local_time.strftime('%Y%m%d_%H%M%S')}-{title}", fmt, compression),
+            mime=MIMES[fmt],
+            on_click='ignore',
+        )
+
+
 def transform_link_path(filepath):
     filepath = filepath.lstrip("./")
     return filepath.replace("/", "-").replace(".", "-")
 
 
 async def load_json_data(json_container):
-    cnt = 0
-    inner_container = json_container.container()
     dashboard_target_path = os.getenv("DASHBOARD_PATH", "./dashboard")
     pattern = f'{dashboard_target_path}/**/*.decl.json'
-    file_watcher = FileWatcher(pattern)
+    # NOTE: the file watcher (e.g. the inotify fd) is closed when the loop ends or is cancelled
+    with contextlib.closing(create_file_watcher(pattern)) as file_watcher:
+        await watch_json_data(json_container, file_watcher)
+
+
+async def watch_json_data(json_container, file_watcher):
+    cnt = 0
+    inner_container = json_container.container()
     containers = {}
     tasks = {}
     head_placeholder = inner_container.empty()
     head_placeholders = []
     while st.session_state.running:
-        files = file_watcher.watch()
+        iteration_start = time.perf_counter()
+        with METRICS.time('dashboard_file_watcher_watch_seconds'):
+            files = file_watcher.watch()
         head_placeholder.empty()
         with head_placeholder.container():
             st.write('Graph Hyper Links')
@@ -296,6 +263,8 @@ async def load_json_data(json_container):
                 continue
             elif status == FileWatcherConst.DELETED:
                 containers[file].empty()
+                if tasks[file]:
+                    tasks[file].cancel()
                 continue
             else:
                 st.error(f"Unknown status '{status}' at '{file}'")
@@ -307,6 +276,8 @@ async def load_json_data(json_container):
                 async with aiofiles.open(file, mode='r') as f:
                     contents = await f.read()
                     json_data = json.loads(contents)
+                    mod_time = files[file]['mod_time']
+                    plan = get_plan(file, mod_time, json_data)
                     show_flag = st.checkbox(
                         "show plots",
                         value=True,
@@ -315,8 +286,13 @@ async def load_json_data(json_container):
                         key=f'{file}')
                     if not show_flag:
                         continue
+                    export = ExportTarget()
+                    create_export_controls(export, json_data, file)
+                    # NOTE: each render replaces the previous one
+                    component_container = st.empty()
                     if 'data' in json_data:
                         df = pd.DataFrame(json_data['data'])
+                        data_key = (file, mod_time)
                     elif 'ref-data' in json_data:
                         basedir_path = os.path.dirname(file
                                                        if os.path.isabs(file) else os.path.realpath(file))
@@ -327,9 +303,15 @@ async def load_json_data(json_container):
                         if ext == '.json':
                             with open(ref_file_full_path) as f:
                                 df = pd.DataFrame(json.load(f))
-                        elif ext == '.jsonl':
+                            df = apply_schema(df, json_data['ref-data'].get('schema'))
+                            data_key = (ref_file_full_path,
+                                        os.path.getmtime(ref_file_full_path))
+                        elif ext in ('.jsonl', '.csv'):
                             task = asyncio.create_task(
-                                async_file_load(ref_file_full_path, json_data, container))
+                                async_file_load(ref_file_full_path, json_data,
+                                                component_container, plan,
+                                                component_key=file, export=export,
+                                                live=create_live_chart(json_data, file)))
                             tasks[file] = task
                             continue
                         else:
@@ -340,53 +322,61 @@ async def load_json_data(json_container):
                         st.error(
                             f'There is no "data" or "ref-data" field at {file}')
                         continue
-                    create_component(df, json_data)
-        await asyncio.sleep(1.0)
+                    with component_container.container():
+                        create_component(df, json_data, plan, data_key,
+                                         export=export, key=f'{file}-{mod_time}-plot')
+        METRICS.observe('dashboard_load_json_data_seconds', time.perf_counter() - iteration_start)
+        update_diagnostics()
+        await file_watcher.wait(1.0)
         cnt += 1
     await asyncio.gather(*tasks.values())
 
 
-async def async_file_load(target_filepath, decl, container=st.empty()):
+async def async_file_load(target_filepath, decl,
+                          container=st.empty(), plan=None, component_key=None, export=None,
+                          live=None):
+    # NOTE: component_key is the key of the "show plots" checkbox
+    ref_data = decl['ref-data']
+    # NOTE: the file is tailed and decoded once per process and shared by all sessions
+    source = subscribe_data_source(
+        target_filepath,
+        max_rows=ref_data.get('max-rows'),
+        max_age=ref_data.get('max-age-seconds'),
+        time_column=ref_data.get('time-column', 'unixtime'),
+        cache=ref_data.get('cache', False),
+        line_column=ref_data.get('line-column'),
+        schema=ref_data.get('schema'))
+    scheduler = get_render_scheduler()
+    scheduler_key = component_key or target_filepath
+    state = scheduler.reset(scheduler_key)
+    coalesced = state.coalesced
     try:
-        cnt = 0
-        data = []
-        tmp_data = []
-        async with aiofiles.open(target_filepath, mode='r') as f:
-            updated = False
-            cnt = 0
-            while st.session_state.running:
-                # NOTE: 1000データごともしくは終端データのタイミングで描画する
-                line = await f.readline()
-                if line:
-                    cnt += 1
-                    jsonl = json.loads(line)
-                    tmp_data.append(jsonl)
-                    updated = True
-                    if cnt % 1000 > 0:
-                        continue
-                if not updated:
-                    await asyncio.sleep(0.01)
-                    continue
-
-                updated = False
-                data += tmp_data
-                tmp_data = []
-
-                # 1行1データの場合
-                if isinstance(data[0], dict):
-                    df = pd.DataFrame(data)
-                else:
-                    # 1行複数データの場合
-                    df_list = []
-                    for entry in data:
-                        temp_df = pd.DataFrame(entry)
-                        df_list.append(temp_df)
-                    df = pd.concat(df_list, ignore_index=True)
-
-                # 'index'のカラムを自動的に付与する
-                df.reset_index(inplace=True)
-                with container:
-                    create_component(df, decl)
+        while st.session_state.running:
+            # NOTE: wait for a new version, the updates during the wait are coalesced into one render
+            await scheduler.wait(
+                scheduler_key, lambda: source.version,
+                lambda: st.session_state.get(component_key, True))
+            version, stream, df = source.snapshot()
+            error = source.error
+
+            # 'index'のカラムを自動的に付与する
+            df.reset_index(inplace=True)
+            start = time.monotonic()
+            METRICS.observe('dashboard_queue_lag_seconds', start - state.pending_since,
+                            decl=scheduler_key)
+            with container.container():
+                if error is not None:
+                    st.error(error)
+                create_component(df, decl, plan,
+                                 data_key=(source.key, version), stream=stream,
+                                 export=export, live=live,
+                                 key=f'{scheduler_key}-{state.renders}-plot')
+            duration = time.monotonic() - start
+            scheduler.rendered(scheduler_key, version, duration)
+            METRICS.observe('dashboard_render_seconds', duration, decl=scheduler_key)
+            METRICS.inc('dashboard_coalesced_versions_total', state.coalesced - coalesced,
+                        decl=scheduler_key)
+            coalesced = state.coalesced
     except asyncio.CancelledError as e:
         print(
             f"📒[asyncio.CancelledError]Task async_file_load {target_filepath} was cancelled {e}")
@@ -396,6 +386,8 @@ async def async_file_load(target_filepath, decl, container=st.empty()):
     except Exception as e:
         print(
             f"📒[Exception]Task async_file_load {target_filepath} was cancelled {e}")
+    finally:
+        source.unsubscribe()
 
 
 def authenticate(config_filepath):
@@ -435,7 +427,15 @@ print(f'[✅] authenticated')
 st.session_state.message = ''
 
 
+def get_render_scheduler():
+    if 'render_scheduler' not in st.session_state:
+        st.session_state.render_scheduler = RenderScheduler()
+    return st.session_state.render_scheduler
+
+
 def setup_sidebar():
+    get_render_scheduler().max_fps = st.sidebar.slider(
+        'max fps of each graph', 0.1, 10.0, 2.0)
     start = st.sidebar.button('start(TODO: implement)')
     stop = st.sidebar.button('stop(TODO: implement)')
 
@@ -449,8 +449,22 @@ def setup_sidebar():
         st.session_state.running = False
 
 
+# NOTE: the metrics are exported in the Prometheus text format
+if os.getenv('METRICS_FILE'):
+    start_prometheus_file_writer(os.getenv('METRICS_FILE'))
+if os.getenv('METRICS_PORT'):
+    start_prometheus_server(int(os.getenv('METRICS_PORT')))
+
 setup_sidebar()
 
+# NOTE: the metrics of the process, updated at each iteration of load_json_data
+with st.sidebar.expander('diagnostics'):
+    diagnostics = st.empty()
+
+
+def update_diagnostics():
+    diagnostics.dataframe(METRICS.to_dataframe(), hide_index=True)
+
 # disk_col1, disk_col2 = st.columns(2)
 # with disk_col1.container(border=True):
 # components.create_disk_usage_layout()
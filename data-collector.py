@@ -5,11 +5,12 @@ import psutil
 import time
 import subprocess
 import asyncio
-from tinydb import TinyDB, Query
 import coloredlogs
 import inspect
 
-db = TinyDB("db.json")
+from collector_store import CollectorStore
+
+db = CollectorStore("collector.db")
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def _merge_dtype(current, incoming):
+    if current == incoming:
+        return current
+    if current.kind in 'iuf' and incoming.kind in 'iuf':
+        return np.result_type(current, incoming)
+    return np.dtype(object)
+
+
+def _missing_dtype(dtype):
+    # NOTE: the dtype which can hold a missing value for rows without the column
+    if dtype.kind in 'fOM':
+        return dtype
+    if dtype.kind in 'iu':
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+def _missing_value(dtype):
+    if dtype.kind == 'M':
+        return np.datetime64('NaT')
+    return np.nan if dtype.kind == 'f' else None
+
+
+def unixtime_scale(value):
+    # NOTE: unixtime columns are written in [s] or [ms]
+    return 1000.0 if abs(value) > 1e11 else 1.0
+
+
+class ColumnarBuffer:
+    # NOTE: append-only typed column arrays
+    # The arrays grow in chunks (capacity doubling), so appending N rows costs O(N) amortized
+    # and to_dataframe() only wraps the filled part of the arrays without copying.
+    # With max_rows/max_age the buffer behaves as a ring buffer: old rows are evicted by
+    # moving the begin position and the live rows are compacted only when the arrays are full.
+    # category_columns are dictionary-encoded: int32 codes (-1: missing) and the values in the order of appearance
+    # (the values of the evicted rows are kept, e.g. the keys of the processes which have exited).
+    def __init__(self, chunk_size=1024, max_rows=None, max_age=None,
+                 time_column='unixtime', category_columns=()):
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.time_column = time_column
+        self.category_columns = set(category_columns)
+        # NOTE: name -> {value: code}
+        self.categories = {}
+        self.capacity = 0
+        self.begin = 0
+        self.end = 0
+        # NOTE: number of rows evicted so far (= absolute row number of begin)
+        self.offset = 0
+        self.columns = {}
+
+    def __len__(self):
+        return self.end - self.begin
+
+    def _reallocate(self, capacity):
+        # NOTE: always allocate new arrays, dataframes returned before still refer to the old ones
+        live = self.end - self.begin
+        for name, array in self.columns.items():
+            new_array = np.empty(capacity, dtype=array.dtype)
+            new_array[:live] = array[self.begin:self.end]
+            self.columns[name] = new_array
+        self.capacity = capacity
+        self.begin = 0
+        self.end = live
+
+    def _grow(self, n):
+        if self.end + n <= self.capacity:
+            return
+        required = self.end - self.begin + n
+        capacity = self.capacity
+        if required * 2 > capacity:
+            capacity = max(capacity * 2, required * 2, self.chunk_size)
+        self._reallocate(capacity)
+
+    def _retype(self, name, dtype):
+        array = self.columns[name]
+        if array.dtype == dtype:
+            return
+        new_array = np.empty(self.capacity, dtype=dtype)
+        new_array[self.begin:self.end] = array[self.begin:self.end]
+        self.columns[name] = new_array
+
+    def _add_column(self, name, dtype):
+        if name in self.category_columns:
+            array = np.empty(self.capacity, dtype=np.int32)
+            array[self.begin:self.end] = -1
+            self.columns[name] = array
+            return
+        if self.end > self.begin:
+            dtype = _missing_dtype(dtype)
+        array = np.empty(self.capacity, dtype=dtype)
+        if self.end > self.begin:
+            array[self.begin:self.end] = _missing_value(dtype)
+        self.columns[name] = array
+
+    def _encode(self, name, values):
+        codes = self.categories.setdefault(name, {})
+        inverse, uniques = pd.factorize(values)
+        if len(uniques) == 0:
+            return np.full(len(values), -1, dtype=np.int32)
+        mapping = np.array([codes.setdefault(value, len(codes)) for value in uniques], dtype=np.int32)
+        return np.where(inverse < 0, -1, mapping[inverse]).astype(np.int32, copy=False)
+
+    def evict(self, now=None):
+        n = 0
+        if self.max_rows is not None:
+            n = max(n, len(self) - self.max_rows)
+        if self.max_age is not None and self.time_column in self.columns \
+                and len(self) > 0:
+            times = self.columns[self.time_column][self.begin:self.end]
+            if times.dtype.kind in 'iuf':
+                if now is None:
+                    now = time.time()
+                cutoff = (now - self.max_age) * unixtime_scale(times[-1])
+                # NOTE: rows are assumed to be appended in time order
+                n = max(n, int(np.searchsorted(times, cutoff, side='left')))
+        if n <= 0:
+            return 0
+        self.begin += n
+        self.offset += n
+        return n
+
+    def drop_head(self, n):
+        n = min(max(n, 0), len(self))
+        self.begin += n
+        self.offset += n
+
+    def clear(self):
+        self.offset += len(self)
+        self.capacity = 0
+        self.begin = 0
+        self.end = 0
+        self.columns = {}
+        self.categories = {}
+
+    def append_rows(self, rows):
+        if len(rows) == 0:
+            return
+        self.append_frame(pd.DataFrame(rows))
+
+    def append_frame(self, df):
+        self.append_columns({name: df[name].to_numpy() for name in df.columns}, len(df.index))
+
+    def append_table(self, table):
+        # NOTE: pyarrow.Table (e.g. the memory-mapped segments of the cache),
+        # the columns are copied into the arrays without building a DataFrame
+        self.append_columns({name: column.to_numpy() for name, column
+                             in zip(table.column_names, table.columns)}, table.num_rows)
+
+    def append_columns(self, columns, n):
+        # NOTE: columns: {name: array of n values}
+        if n == 0:
+            return
+        self._grow(n)
+        begin, end = self.end, self.end + n
+        for name, values in columns.items():
+            if name in self.category_columns:
+                if name not in self.columns:
+                    self._add_column(name, None)
+                self.columns[name][begin:end] = self._encode(name, values)
+                continue
+            if values.dtype.kind not in 'biufOM':
+                values = values.astype(object)
+            if name not in self.columns:
+                self._add_column(name, values.dtype)
+            self._retype(name, _merge_dtype(self.columns[name].dtype, values.dtype))
+            self.columns[name][begin:end] = values
+        for name in self.columns:
+            if name in columns:
+                continue
+            if name in self.category_columns:
+                self.columns[name][begin:end] = -1
+                continue
+            dtype = _missing_dtype(self.columns[name].dtype)
+            self._retype(name, dtype)
+            self.columns[name][begin:end] = _missing_value(dtype)
+        self.end = end
+        self.evict()
+
+    def to_dataframe(self):
+        # NOTE: the index is the absolute row number, so it is stable while rows are evicted
+        index = pd.RangeIndex(self.offset, self.offset + len(self))
+        # NOTE: explicit dtype skips the O(rows) dtype inference of object columns
+        return pd.DataFrame(
+            {name: pd.Series(pd.Categorical.from_codes(
+                array[self.begin:self.end], categories=list(self.categories[name]), validate=False),
+                index=index, copy=False) if name in self.category_columns else
+             pd.Series(array[self.begin:self.end], index=index,
+                       dtype=array.dtype, copy=False)
+             for name, array in self.columns.items()},
+            index=index,
+            copy=False)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import time
+import traceback
+
+import pandas as pd
+
+from data_buffer import ColumnarBuffer
+from decoders import create_decoder, get_schema
+from metrics import METRICS
+from operators import StreamPosition
+from sidecar_cache import SidecarCache
+from tailer import FileTailer
+
+
+class DataSource:
+    # NOTE: one ingest pipeline (tailer + decoder + buffer) per data file which is shared by all sessions
+    # The background thread tails and decodes the file once, and the sessions take snapshots
+    # whenever the version is changed.
+    def __init__(self, key, filepath, max_rows=None, max_age=None,
+                 time_column='unixtime', cache=False, poll_interval=0.01, linger=60.0,
+                 cache_segment_rows=100000, cache_flush_interval=10.0, line_column=None,
+                 schema=None):
+        self.key = key
+        self.filepath = filepath
+        self.poll_interval = poll_interval
+        self.linger = linger
+        self.lock = threading.Lock()
+        self.tailer = FileTailer(filepath)
+        self.decoder = create_decoder(filepath, line_column=line_column)
+        self.convert, category_columns = get_schema(schema)
+        self.buffer = ColumnarBuffer(
+            max_rows=max_rows, max_age=max_age, time_column=time_column,
+            category_columns=category_columns)
+        self.cache = None
+        self.cache_segment_rows = cache_segment_rows
+        self.cache_flush_interval = cache_flush_interval
+        # NOTE: decoded frames which are not written to the cache yet
+        self.pending_frames = []
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+        if cache:
+            if SidecarCache.available():
+                self.cache = SidecarCache(filepath)
+            else:
+                print(f"📒[DataSource] pyarrow is not installed, cache is disabled for {filepath}")
+        self.version = 0
+        # NOTE: incremented when the rows are replaced (e.g. the file was rotated)
+        self.generation = 0
+        self.error = None
+        self.subscribers = 0
+        self.idle_since = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name=f'DataSource({filepath})', daemon=True)
+
+    def _load_cache(self):
+        try:
+            loaded = self.cache.load(max_rows=self.buffer.max_rows)
+        except Exception as e:
+            print(f"📒[DataSource] failed to load the cache of {self.filepath}: {e}")
+            self.cache.clear()
+            return
+        if loaded is None:
+            return
+        tables, skipped_rows, checkpoint = loaded
+        with self.lock:
+            self.buffer.offset += skipped_rows
+            for table in tables:
+                self.buffer.append_table(table)
+            self.version += 1
+        self.tailer = FileTailer(self.filepath, checkpoint=checkpoint)
+        with self.lock:
+            tail = self.buffer.to_dataframe().tail(1)
+        self.decoder.resume(self.filepath, tail)
+
+    def _flush_cache(self, force=False):
+        if self.cache is None or self.pending_rows == 0:
+            return
+        if not force and self.pending_rows < self.cache_segment_rows and \
+                time.monotonic() - self.last_flush < self.cache_flush_interval:
+            return
+        df = pd.concat(self.pending_frames, ignore_index=True)
+        self.pending_frames = []
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+        try:
+            self.cache.append(df, self.tailer.checkpoint())
+        except Exception as e:
+            # e.g. mixed types in a column, read-only directory
+            print(f"📒[DataSource] cache is disabled for {self.filepath}: {e}")
+            self.cache.clear()
+            self.cache = None
+
+    def _ingest(self):
+        lines, reset = self.tailer.read_lines()
+        if reset:
+            print(f"📒[DataSource] {self.filepath} was truncated or rotated")
+            self.decoder.reset()
+            self.pending_frames = []
+            self.pending_rows = 0
+            if self.cache is not None:
+                self.cache.clear()
+        if not reset and len(lines) == 0:
+            self._flush_cache()
+            if self.buffer.max_age is not None:
+                with self.lock:
+                    if self.buffer.evict() > 0:
+                        self.version += 1
+            return False
+        METRICS.inc('dashboard_bytes_read_total',
+                    sum(map(len, lines)) + len(lines), file=self.filepath)
+        with METRICS.time('dashboard_decode_seconds', file=self.filepath):
+            df = self.decoder.decode(lines)
+            if self.convert is not None:
+                df = self.convert(df)
+        METRICS.inc('dashboard_rows_ingested_total', len(df.index), file=self.filepath)
+        with self.lock:
+            if reset:
+                self.buffer.clear()
+                self.generation += 1
+            self.buffer.append_frame(df)
+            self.version += 1
+            self.error = None
+        if self.cache is not None and len(df.index) > 0:
+            self.pending_frames.append(df)
+            self.pending_rows += len(df.index)
+            self._flush_cache()
+        return True
+
+    def _expired(self):
+        with _registry_lock:
+            if self.subscribers > 0 or time.monotonic() - self.idle_since < self.linger:
+                return False
+            _sources.pop(self.key, None)
+            return True
+
+    def _run(self):
+        if self.cache is not None:
+            self._load_cache()
+        while not self.stop_event.is_set():
+            try:
+                if self._ingest():
+                    continue
+            except Exception:
+                # NOTE: the lines of the failed chunk are skipped (the tailer has already advanced),
+                # the sessions show the error until the next lines are decoded
+                error = f'🔥[Exception] DataSource({self.filepath}), the lines were skipped\n' \
+                    f'{traceback.format_exc()}'
+                if error != self.error:
+                    with self.lock:
+                        self.error = error
+                        self.version += 1
+                    print(error)
+            if self._expired():
+                break
+            self.stop_event.wait(self.poll_interval)
+        self._flush_cache(force=True)
+        self.tailer.close()
+
+    def snapshot(self):
+        # NOTE: returns (version, stream position, df), the position is for the incremental stages
+        with self.lock:
+            stream = StreamPosition((self.key, self.generation), self.buffer.offset)
+            return self.version, stream, self.buffer.to_dataframe()
+
+    def unsubscribe(self):
+        with _registry_lock:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                # NOTE: keep the decoded rows for a while (e.g. the decl file is being edited)
+                self.idle_since = time.monotonic()
+
+    def stop(self):
+        with _registry_lock:
+            if _sources.get(self.key) is self:
+                _sources.pop(self.key)
+        self.stop_event.set()
+
+
+_registry_lock = threading.Lock()
+_sources = {}
+
+
+def subscribe_data_source(filepath, max_rows=None, max_age=None,
+                          time_column='unixtime', cache=False, line_column=None, schema=None):
+    # NOTE: the sources are shared by the resolved path and the retention/decode/cache options
+    key = (os.path.realpath(filepath), max_rows, max_age, time_column, line_column, schema, cache)
+    with _registry_lock:
+        source = _sources.get(key)
+        if source is None:
+            source = DataSource(key, filepath, max_rows=max_rows,
+                                max_age=max_age, time_column=time_column, cache=cache,
+                                line_column=line_column, schema=schema)
+            _sources[key] = source
+            source.thread.start()
+        source.subscribers += 1
+    return source
+
+
+def get_data_sources():
+    with _registry_lock:
+        return list(_sources.values())
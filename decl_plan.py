@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.subplots
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+from data_buffer import ColumnarBuffer
+from metrics import METRICS
+from downsample import downsample_dataframe
+from operators import AutoDatetime, MovingAverage, EWMA, Diff, Rate
+from rollup import Resample
+from top import pivot_top_n
+from render_mode import apply_render_mode, DEFAULT_WEBGL_THRESHOLD, RENDER_MODES
+
+PREPRO = 'prepro'
+FIGURE = 'figure'
+RENDER = 'render'
+
+# NOTE: name -> StageSpec
+STAGES = {}
+
+
+class StageSpec:
+    def __init__(self, name, handler, kind, required=(),
+                 needs_figure=False, reduces_rows=False, incremental=False, render_mode=False):
+        self.name = name
+        self.handler = handler
+        self.kind = kind
+        self.required = required
+        self.needs_figure = needs_figure
+        # NOTE: the rows after this stage are only for the plots (e.g. downsampled)
+        self.reduces_rows = reduces_rows
+        # NOTE: handler is an IncrementalOperator class, only the appended rows are computed
+        self.incremental = incremental
+        # NOTE: the render stage takes render_mode and webgl_threshold of the decl
+        self.render_mode = render_mode
+
+
+def register_stage(name, kind, **kwargs):
+    # prepro: handler(df, **args) -> df (must not modify the input df)
+    #   incremental=True: handler(**args) -> IncrementalOperator
+    # figure: handler(df, fig, **args) -> fig (fig is a copy, so it can be modified)
+    # render: handler(df, **args) -> None
+    #   render_mode=True: handler(df, render_mode, webgl_threshold, **args) -> None
+    def decorator(handler):
+        STAGES[name] = StageSpec(name, handler, kind, **kwargs)
+        return handler
+    return decorator
+
+
+class Stage:
+    def __init__(self, spec, args):
+        self.spec = spec
+        self.args = args
+        self.args_key = json.dumps(args, sort_keys=True, default=str)
+
+    @property
+    def name(self):
+        return self.spec.name
+
+
+# NOTE: [s] the derived rows are kept for the begins which were read in this period, so a session
+# whose snapshot is behind the others (the plans are shared) reads them instead of recomputing the window
+READER_TTL = 60.0
+
+
+class IncrementalState:
+    def __init__(self, operator, stream_key):
+        self.operator = operator
+        self.stream_key = stream_key
+        # NOTE: derived columns, the offset is the absolute row number of the first row
+        self.store = ColumnarBuffer()
+        # NOTE: begin -> the last time the rows from it were read
+        self.readers = {}
+
+
+class Plan:
+    # NOTE: validated stages of a decl and the cached outputs of the prepro/figure stages
+    # The cache key of a stage is the chain of (data key, stage name, args) up to the stage,
+    # so a stage is re-run only when the data or the args of itself or of the previous stages are changed.
+    def __init__(self, stages, errors, render_mode='auto', webgl_threshold=DEFAULT_WEBGL_THRESHOLD,
+                 name=''):
+        # NOTE: name: the label of the metrics (e.g. the decl file path)
+        self.name = name
+        self.stages = stages
+        self.errors = errors
+        # NOTE: 'auto': WebGL if the figure has more points than webgl_threshold, 'svg' or 'webgl'
+        self.render_mode = render_mode
+        self.webgl_threshold = webgl_threshold
+        self.cache = {}
+        # NOTE: states of the incremental stages, static chain key -> IncrementalState
+        self.states = {}
+        self.lock = threading.Lock()
+
+    @property
+    def reduces_rows(self):
+        return any(stage.spec.reduces_rows for stage in self.stages)
+
+    def _cached(self, used, key, compute):
+        if used is None:
+            return compute()
+        with self.lock:
+            if key in self.cache:
+                used[key] = self.cache[key]
+                return used[key]
+        value = compute()
+        used[key] = value
+        return value
+
+    def _run_incremental(self, stage, static_key, df, stream):
+        spec = stage.spec
+        if stream is None:
+            operator = spec.handler(**stage.args)
+            columns = {name: np.asarray(values)
+                       for name, values in operator.extend(df).items()}
+            return operator.finalize(df.copy(deep=False), columns)
+        begin = stream.begin
+        end = begin + len(df.index)
+        with self.lock:
+            state = self.states.get(static_key)
+            if state is None or state.stream_key != stream.key or \
+                    not state.store.offset <= begin <= state.store.offset + len(state.store):
+                # NOTE: a new stream (e.g. the file was rotated) or the rows are not continuous
+                state = IncrementalState(spec.handler(**stage.args), stream.key)
+                state.store.offset = begin
+                self.states[static_key] = state
+            store = state.store
+            store_end = store.offset + len(store)
+            if end > store_end:
+                new_df = df.iloc[store_end - begin:]
+                columns = state.operator.extend(new_df)
+                store.append_frame(pd.DataFrame(
+                    columns, index=pd.RangeIndex(len(new_df.index))))
+            now = time.monotonic()
+            state.readers[begin] = now
+            state.readers = {reader: seen for reader, seen in state.readers.items()
+                             if now - seen < READER_TTL}
+            # NOTE: the rows before the oldest begin of the readers were evicted
+            store.drop_head(min(state.readers) - store.offset)
+            start = store.begin + begin - store.offset
+            columns = {name: array[start:start + len(df.index)]
+                       for name, array in store.columns.items()}
+            return state.operator.finalize(df.copy(deep=False), columns)
+
+    def run(self, df, data_key=None, stream=None):
+        # NOTE: returns (df, data_df, fig) and calls the render stages in the decl order
+        # data_key identifies the input data (e.g. (source key, version)), None disables the cache
+        # stream (StreamPosition) enables the incremental stages to compute only the appended rows
+        used = None if data_key is None else {}
+        key = hashlib.sha1(repr(data_key).encode()).hexdigest()
+        static_key = ''
+        fig = None
+        data_df = None
+        for stage in self.stages:
+            spec = stage.spec
+            key = hashlib.sha1(
+                f'{key}\0{stage.name}\0{stage.args_key}'.encode()).hexdigest()
+            static_key = hashlib.sha1(
+                f'{static_key}\0{stage.name}\0{stage.args_key}'.encode()).hexdigest()
+            start = time.perf_counter()
+            if spec.kind == PREPRO:
+                if spec.reduces_rows and data_df is None:
+                    data_df = df
+                if spec.incremental:
+                    df = self._cached(used, key, lambda: self._run_incremental(
+                        stage, static_key, df, stream))
+                else:
+                    df = self._cached(used, key, lambda: spec.handler(df, **stage.args))
+                if spec.reduces_rows:
+                    # NOTE: the rows are no longer the rows of the stream
+                    stream = None
+            elif spec.kind == FIGURE:
+                fig = self._cached(used, key, lambda: spec.handler(
+                    df, go.Figure(fig) if fig is not None else None, **stage.args))
+            elif spec.render_mode:
+                spec.handler(df, **{'render_mode': self.render_mode,
+                                    'webgl_threshold': self.webgl_threshold, **stage.args})
+            else:
+                spec.handler(df, **stage.args)
+            METRICS.observe('dashboard_stage_seconds', time.perf_counter() - start,
+                            decl=self.name, stage=stage.name)
+        if fig is not None:
+            key = hashlib.sha1(
+                f'{key}\0render-mode\0{self.render_mode}\0{self.webgl_threshold}'.encode()).hexdigest()
+            fig = self._cached(used, key, lambda: apply_render_mode(
+                fig, self.render_mode, self.webgl_threshold))
+        if used is not None:
+            with self.lock:
+                # NOTE: keep only the outputs of the last run
+                self.cache = used
+        if data_df is None:
+            data_df = df
+        return df, data_df, fig
+
+    def run_figure(self, df):
+        # NOTE: runs only the figure stages (e.g. for the appended rows of the output of run)
+        fig = None
+        for stage in self.stages:
+            if stage.spec.kind == FIGURE:
+                fig = stage.spec.handler(
+                    df, go.Figure(fig) if fig is not None else None, **stage.args)
+        return fig
+
+
+def compile_plan(decl, name=''):
+    stages = [Stage(STAGES['auto.datetime'], {})]
+    errors = []
+    render_mode = decl.get('render-mode', 'auto')
+    if render_mode not in RENDER_MODES:
+        errors.append(f"🔥Unknown render-mode '{render_mode}' (one of {list(RENDER_MODES)})")
+        render_mode = 'auto'
+    webgl_threshold = decl.get('webgl-threshold', DEFAULT_WEBGL_THRESHOLD)
+    has_figure = False
+    for i, func in enumerate(decl.get('funcs', [])):
+        func_name = func.get('name')
+        args = func.get('args', {})
+        if func_name not in STAGES:
+            errors.append(f"🔥Unknown func.name '{func_name}'")
+            continue
+        spec = STAGES[func_name]
+        if not isinstance(args, dict):
+            errors.append(f"🔥[{func_name}] 'args' must be an object")
+            continue
+        missing = [name for name in spec.required if name not in args]
+        if missing:
+            errors.append(f"🔥[{func_name}] Required args {missing}")
+            continue
+        if spec.needs_figure and not has_figure:
+            errors.append(f"🔥[{func_name}] There is no figure before funcs[{i}]")
+            continue
+        if spec.kind == FIGURE:
+            has_figure = True
+        stages.append(Stage(spec, args))
+    return Plan(stages, errors, render_mode, webgl_threshold, name)
+
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+def get_plan(decl_filepath, mod_time, decl):
+    # NOTE: compile once per mtime of the decl file, the cached outputs are carried over
+    with _plans_lock:
+        plan = _plans.get(decl_filepath)
+        if plan is not None and plan.mod_time == mod_time:
+            return plan
+        new_plan = compile_plan(decl, decl_filepath)
+        new_plan.mod_time = mod_time
+        if plan is not None:
+            new_plan.cache = plan.cache
+            new_plan.states = plan.states
+        _plans[decl_filepath] = new_plan
+        return new_plan
+
+
+register_stage('auto.datetime', PREPRO, incremental=True)(AutoDatetime)
+register_stage('prepro.MA', PREPRO, required=('src',),
+               incremental=True)(MovingAverage)
+register_stage('prepro.EWMA', PREPRO, required=('src',),
+               incremental=True)(EWMA)
+register_stage('prepro.diff', PREPRO, required=('src',),
+               incremental=True)(Diff)
+register_stage('prepro.rate', PREPRO, required=('src',),
+               incremental=True)(Rate)
+register_stage('prepro.resample', PREPRO, reduces_rows=True,
+               incremental=True)(Resample)
+register_stage('prepro.downsample', PREPRO,
+               reduces_rows=True)(downsample_dataframe)
+
+
+@register_stage('plotly.subplots.make_subplots', FIGURE)
+def figure_make_subplots(df, fig, **args):
+    return plotly.subplots.make_subplots(**args)
+
+
+@register_stage('px.line', FIGURE)
+def figure_px_line(df, fig, **args):
+    return px.line(df, **args)
+
+
+@register_stage('px.scatter', FIGURE)
+def figure_px_scatter(df, fig, **args):
+    return px.scatter(df, **args)
+
+
+@register_stage('update_layout', FIGURE, needs_figure=True)
+def figure_update_layout(df, fig, **args):
+    return fig.update_layout(**args)
+
+
+@register_stage('add_scatter', FIGURE, required=('x', 'y'), needs_figure=True)
+def figure_add_scatter(df, fig, x, y, **args):
+    return fig.add_scatter(x=df[x], y=df[y], **args)
+
+
+@register_stage('add_bar', FIGURE, required=('x', 'y'), needs_figure=True)
+def figure_add_bar(df, fig, x, y, **args):
+    return fig.add_bar(x=df[x], y=df[y], **args)
+
+
+@register_stage('st.write', RENDER)
+def render_write(df, **args):
+    st.write(df)
+
+
+@register_stage('st.dataframe', RENDER)
+def render_dataframe(df, **args):
+    st.dataframe(df, **args)
+
+
+@register_stage('st.subheader', RENDER)
+def render_subheader(df, **args):
+    st.subheader(**args)
+
+
+@register_stage('st.metric', RENDER)
+def render_metric(df, **args):
+    st.metric(**args)
+
+
+@register_stage('top', RENDER, render_mode=True)
+def create_top_graph(df, n=10, rank_by='%CPU',
+                     render_mode='auto', webgl_threshold=DEFAULT_WEBGL_THRESHOLD):
+    # NOTE: for debugging
+    # st.write(df)
+
+    # NOTE: n: the number of the keys which are shown, the rest keys are summed up into 'other'
+    # rank_by: '%CPU' or '%MEM', the keys are ranked by the sum in the data
+    # (the numbers are parsed at the ingest by "schema": "top" of ref-data)
+    if len(df.index) == 0:
+        st.error('There is no process data')
+        return
+    cpu_table = pivot_top_n(df, '%CPU', n=n, rank_by=rank_by)
+    mem_table = pivot_top_n(df, '%MEM', n=n, rank_by=rank_by)
+
+    def create_figure(table, title, yaxis_title, stackgroup=None):
+        fig = go.Figure()
+        for key in table.columns:
+            values = table[key]
+            if stackgroup is not None:
+                values = values.fillna(0.0)
+            fig.add_trace(go.Scatter(
+                x=table.index, y=values, stackgroup=stackgroup,
+                mode="lines+markers", name=key))
+        fig.update_layout(title=title,
+                          legend_traceorder='normal',
+                          legend_title_text='key',
+                          xaxis=dict(
+                              title='unixtime',
+                          ),
+                          yaxis=dict(
+                              title=yaxis_title,
+                          ),
+                          )
+        # NOTE: the stacked chart is always SVG (scattergl does not support stackgroup)
+        return apply_render_mode(fig, render_mode, webgl_threshold)
+
+    # CPU Usage
+    line_chart_tab, stacked_chart_tab = st.tabs(
+        ["Line Chart", "Stacked Chart"])
+    with line_chart_tab:
+        st.plotly_chart(create_figure(
+            cpu_table, 'CPU Usage Over Time', '%CPU'))
+
+    with stacked_chart_tab:
+        st.plotly_chart(create_figure(
+            cpu_table, 'Stacked Chart', '%CPU', stackgroup='%CPU'))
+
+    # Memory Usage
+    st.plotly_chart(create_figure(
+        mem_table, 'Memory Usage Over Time', '%MEM'))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import csv
+import io
+import json
+import os
+
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from top import parse_top_numbers, TOP_CATEGORY_COLUMNS
+
+
+def _column_array(values):
+    first = next((value for value in values if value is not None), None)
+    if type(first) in (int, float, bool):
+        array = np.array(values)
+        if array.dtype.kind in 'biuf':
+            return array
+        # NOTE: e.g. None in an int column
+        return pd.Series(values).to_numpy()
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _rows_to_frame(rows):
+    # NOTE: builds the columns directly if all rows have the same keys,
+    # it skips the per value dtype inference of pd.DataFrame(rows)
+    if len(rows) == 0 or not isinstance(rows[0], dict) or len(rows[0]) == 0:
+        return pd.DataFrame(rows)
+    keys = list(rows[0].keys())
+    try:
+        columns = zip(*map(itemgetter(*keys), rows)) if len(keys) > 1 else \
+            [[row[keys[0]] for row in rows]]
+        arrays = {key: _column_array(values) for key, values in zip(keys, columns)}
+    except (KeyError, TypeError):
+        return pd.DataFrame(rows)
+    if any(len(row) != len(keys) for row in rows):
+        # NOTE: some rows have extra keys
+        return pd.DataFrame(rows)
+    return pd.DataFrame({key: pd.Series(array, dtype=array.dtype, copy=False)
+                         for key, array in arrays.items()})
+
+
+class JsonlDecoder:
+    # NOTE: line_column: optional, the column of the line index of each row
+    # (e.g. the snapshot index of the top outputs which have one array per line)
+    def __init__(self, line_column=None):
+        self.line_column = line_column
+        self.reset()
+
+    def decode(self, lines):
+        rows = []
+        counts = []
+        for line in lines:
+            if not line.strip():
+                continue
+            jsonl = json.loads(line)
+            if isinstance(jsonl, list):
+                # 1行複数データの場合
+                rows += jsonl
+                counts.append(len(jsonl))
+            else:
+                # 1行1データの場合
+                rows.append(jsonl)
+                counts.append(1)
+        df = _rows_to_frame(rows)
+        if self.line_column is not None and len(df.index) > 0:
+            df[self.line_column] = np.repeat(
+                np.arange(self.line_index, self.line_index + len(counts)), counts)
+        self.line_index += len(counts)
+        return df
+
+    def reset(self):
+        self.line_index = 0
+
+    def resume(self, filepath, tail=None):
+        # NOTE: tail is the last row which has been decoded before (e.g. from the cache)
+        if self.line_column is not None and tail is not None and \
+                self.line_column in tail and len(tail.index) > 0:
+            self.line_index = int(tail[self.line_column].iloc[-1]) + 1
+
+
+class CsvDecoder:
+    # NOTE: the first line is the header, the schema (dtypes) is inferred from the first chunk
+    # and reused for the following chunks, so each chunk is parsed by one pd.read_csv call.
+    def __init__(self, line_column=None):
+        self.line_column = line_column
+        self.reset()
+
+    def reset(self):
+        self.header_line = None
+        self.columns = None
+        self.dtypes = None
+        self.line_index = 0
+
+    def _set_header(self, line):
+        self.header_line = line.rstrip(b'\r')
+        self.columns = next(csv.reader([self.header_line.decode('utf-8')]))
+
+    def resume(self, filepath, tail=None):
+        # NOTE: the decoding starts from the middle of the file, so read the header line here
+        with open(filepath, mode='rb') as f:
+            line = f.readline()
+        if line.endswith(b'\n'):
+            self._set_header(line.rstrip(b'\n'))
+        if self.line_column is not None and tail is not None and \
+                self.line_column in tail and len(tail.index) > 0:
+            self.line_index = int(tail[self.line_column].iloc[-1]) + 1
+
+    def _tag_lines(self, df):
+        if self.line_column is not None:
+            df[self.line_column] = np.arange(
+                self.line_index, self.line_index + len(df.index))
+        self.line_index += len(df.index)
+        return df
+
+    def _read_csv(self, data, dtype=None):
+        return pd.read_csv(io.BytesIO(data), header=None,
+                           names=self.columns, dtype=dtype)
+
+    def decode(self, lines):
+        body = []
+        for line in lines:
+            if not line.strip():
+                continue
+            if self.header_line is None:
+                self._set_header(line)
+                continue
+            if line.rstrip(b'\r') == self.header_line:
+                # NOTE: the header line is repeated when the outputs are concatenated
+                continue
+            body.append(line)
+        if len(body) == 0:
+            return pd.DataFrame(columns=self.columns)
+        data = b'\n'.join(body)
+        if self.dtypes is None:
+            df = self._read_csv(data)
+            self.dtypes = df.dtypes.to_dict()
+            return self._tag_lines(df)
+        try:
+            return self._tag_lines(self._read_csv(data, dtype=self.dtypes))
+        except (ValueError, TypeError):
+            # NOTE: the inferred schema does not fit (e.g. a float value in an int column)
+            df = self._read_csv(data)
+            for name, dtype in df.dtypes.items():
+                if self.dtypes.get(name) != dtype:
+                    self.dtypes[name] = float if pd.api.types.is_numeric_dtype(
+                        dtype) and pd.api.types.is_numeric_dtype(self.dtypes.get(name)) else object
+            return self._tag_lines(df)
+
+
+# NOTE: "schema" of ref-data: name -> (the converter of the decoded rows, the columns which are stored as categoricals)
+# The rows are converted once at the ingest instead of at each render.
+SCHEMAS = {
+    'top': (parse_top_numbers, TOP_CATEGORY_COLUMNS),
+}
+
+
+def get_schema(schema=None):
+    if schema is None:
+        return None, ()
+    if schema not in SCHEMAS:
+        raise ValueError(f"Unsupported schema '{schema}'")
+    return SCHEMAS[schema]
+
+
+def apply_schema(df, schema=None):
+    # NOTE: for the frames which are not stored in a ColumnarBuffer (e.g. a json file)
+    convert, category_columns = get_schema(schema)
+    if convert is not None:
+        df = convert(df)
+    for name in category_columns:
+        if name in df:
+            df[name] = df[name].astype('category')
+    return df
+
+
+DECODERS = {
+    '.jsonl': JsonlDecoder,
+    '.csv': CsvDecoder,
+}
+
+
+def create_decoder(filepath, line_column=None):
+    _, ext = os.path.splitext(filepath)
+    if ext not in DECODERS:
+        raise ValueError(f"'{ext}' Extension with unimplemented read function. '{filepath}'")
+    return DECODERS[ext](line_column=line_column)
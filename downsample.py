@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+
+def _to_float(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.astype('int64').to_numpy(dtype=np.float64)
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def lttb(x, y, n_out):
+    # NOTE: Largest-Triangle-Three-Buckets
+    # the first and the last points are always kept, each middle bucket keeps the point
+    # which makes the largest triangle with the previous selected point and the average of the next bucket
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.append(
+        np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64), n)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2]
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.where(np.isnan(area), -1.0, area).argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def minmax(y, n_out):
+    # NOTE: keep the min and the max point of each bucket, so peaks are always visible
+    n = len(y)
+    n_buckets = max(1, n_out // 2)
+    if n <= n_out:
+        return np.arange(n)
+    size = -(-n // n_buckets)
+    n_buckets = -(-n // size)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    argmin = np.where(np.isnan(padded), np.inf, padded).argmin(axis=1) + offsets
+    argmax = np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1) + offsets
+    indices = np.concatenate([[0, n - 1], argmin, argmax])
+    return np.unique(np.clip(indices, 0, n - 1))
+
+
+def downsample_dataframe(df, x=None, y=None, n_out=2000,
+                         algorithm='lttb', threshold=None):
+    if threshold is None:
+        threshold = n_out
+    if len(df.index) <= threshold:
+        return df
+    if y is None:
+        y = [col for col in df.columns
+             if col != x and pd.api.types.is_numeric_dtype(df[col])]
+    elif isinstance(y, str):
+        y = [y]
+    if x is None:
+        x_values = np.arange(len(df.index), dtype=np.float64)
+    else:
+        x_values = _to_float(df[x])
+    # NOTE: the rows are shared by the traces, so n_out is split across the y columns
+    # (the union of the selected rows, i.e. the points of each trace, is at most about n_out)
+    n_col_out = max(3, n_out // max(len(y), 1))
+    indices = [np.array([0, len(df.index) - 1])]
+    for col in y:
+        y_values = _to_float(df[col])
+        if algorithm == 'lttb':
+            indices.append(lttb(x_values, y_values, n_col_out))
+        elif algorithm == 'minmax':
+            indices.append(minmax(y_values, n_col_out))
+        else:
+            raise ValueError(f"Unknown downsample algorithm '{algorithm}'")
+    return df.iloc[np.unique(np.concatenate(indices))]
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import threading
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import pandas as pd
+
+MIMES = {
+    'jsonl': 'application/jsonl',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_formats():
+    return [fmt for fmt in MIMES if fmt != 'parquet' or pa is not None]
+
+
+def export_compressions():
+    # NOTE: parquet is compressed by itself (snappy)
+    return [None, 'gzip'] + (['zstd'] if zstandard is not None else [])
+
+
+def filter_time_range(df, begin=None, end=None, time_column='datetime(utc)'):
+    if time_column not in df or (begin is None and end is None):
+        return df
+    mask = pd.Series(True, index=df.index)
+    if begin is not None:
+        mask &= df[time_column] >= begin
+    if end is not None:
+        mask &= df[time_column] <= end
+    return df[mask]
+
+
+def _iter_jsonl(df, chunk_rows):
+    for begin in range(0, len(df.index), chunk_rows):
+        yield df.iloc[begin:begin + chunk_rows].to_json(
+            orient='records', lines=True, date_format='iso').encode()
+
+
+def _iter_csv(df, chunk_rows):
+    yield df.iloc[0:0].to_csv(header=True, index=False).encode()
+    for begin in range(0, len(df.index), chunk_rows):
+        yield df.iloc[begin:begin + chunk_rows].to_csv(header=False, index=False).encode()
+
+
+class _ChunkSink:
+    # NOTE: file-like object for pyarrow which keeps the written bytes until they are taken
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _iter_parquet(df, chunk_rows):
+    sink = _ChunkSink()
+    writer = None
+    for begin in range(0, max(len(df.index), 1), chunk_rows):
+        table = pa.Table.from_pandas(df.iloc[begin:begin + chunk_rows], preserve_index=False)
+        if writer is None:
+            writer = pa.parquet.ParquetWriter(sink, table.schema)
+        # NOTE: one row group per chunk
+        writer.write_table(table)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def _compress(chunks, compression):
+    if compression is None:
+        yield from chunks
+        return
+    if compression == 'gzip':
+        compressor = zlib.compressobj(wbits=31)
+    elif compression == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError(f"Unsupported compression '{compression}'")
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(df, fmt='jsonl', compression=None, chunk_rows=100000):
+    # NOTE: yields the serialized bytes chunk by chunk, only a chunk of rows is serialized at a time
+    if fmt == 'jsonl':
+        chunks = _iter_jsonl(df, chunk_rows)
+    elif fmt == 'csv':
+        chunks = _iter_csv(df, chunk_rows)
+    elif fmt == 'parquet':
+        if pa is None:
+            raise ValueError('pyarrow is required for parquet')
+        chunks = _iter_parquet(df, chunk_rows)
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'")
+    yield from _compress(chunks, compression)
+
+
+def export_file_name(title, fmt, compression=None):
+    suffix = {None: '', 'gzip': '.gz', 'zstd': '.zst'}[compression]
+    return f'{title}.{fmt}{suffix}'
+
+
+class ExportTarget:
+    # NOTE: the latest data of a component, which is serialized only when the download is requested
+    # (the components update the reference at each render, it costs nothing)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.df = None
+
+    def update(self, df):
+        with self.lock:
+            self.df = df
+
+    def export(self, fmt='jsonl', compression=None, last_seconds=None,
+               time_column='datetime(utc)'):
+        # NOTE: last_seconds: optional, only the rows of the last N seconds of the data
+        with self.lock:
+            df = self.df
+        if df is None:
+            df = pd.DataFrame()
+        if 'index' in df.columns:
+            df = df.drop(['index'], axis='columns')
+        if last_seconds is not None and time_column in df and len(df.index) > 0:
+            end = df[time_column].max()
+            df = filter_time_range(df, end - pd.Timedelta(seconds=last_seconds), end, time_column)
+        # NOTE: st.download_button takes the whole payload as bytes, the chunks are joined once here
+        return b''.join(iter_export(df, fmt, compression))
@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
 import glob
 import os
+import struct
+import sys
 import time
 
 
@@ -58,10 +65,255 @@ class FileWatcher:
         self.previous_mod_times = current_mod_times
         return changes
 
+    async def wait(self, timeout):
+        await asyncio.sleep(timeout)
+
+    def close(self):
+        pass
+
+
+def _split_pattern(pattern):
+    # NOTE: '' as the root means the current directory without './' prefix (same as glob.glob)
+    parts = pattern.split('/')
+    for i, part in enumerate(parts):
+        if glob.has_magic(part):
+            return '/'.join(parts[:i]), parts[i:]
+    return os.path.dirname(pattern), [os.path.basename(pattern)]
+
+
+def _match_parts(patterns, parts):
+    # NOTE: same rule as glob.glob(recursive=True), '*' and '**' do not match hidden names
+    if not patterns:
+        return not parts
+    if patterns[0] == '**':
+        for i in range(len(parts) + 1):
+            if i > 0 and parts[i - 1].startswith('.'):
+                break
+            if _match_parts(patterns[1:], parts[i:]):
+                return True
+        return False
+    if not parts:
+        return False
+    if parts[0].startswith('.') and not patterns[0].startswith('.'):
+        return False
+    return fnmatch.fnmatchcase(
+        parts[0], patterns[0]) and _match_parts(patterns[1:], parts[1:])
+
+
+class InotifyFileWatcher(FileWatcher):
+    # NOTE: event-driven backend of FileWatcher for Linux
+    # Only the paths reported by inotify are stat()ed, so watch() does not touch the file system at idle.
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = os.O_CLOEXEC
+    # NOTE: IN_MODIFY is not watched to avoid reading half-written files, the files are reported at IN_CLOSE_WRITE
+    WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+        IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    EVENT_HEADER = struct.Struct('iIII')
+
+    _libc = None
+
+    @classmethod
+    def _get_libc(cls):
+        if cls._libc is None:
+            libc = ctypes.CDLL(
+                ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            cls._libc = libc
+        return cls._libc
+
+    def __init__(self, pattern):
+        super().__init__(pattern)
+        self.root, self.patterns = _split_pattern(pattern)
+        if not os.path.isdir(self.root or '.'):
+            raise FileNotFoundError(f"No such directory '{self.root}'")
+        self.libc = self._get_libc()
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        self.rescan = True
+        # NOTE: the events which were read by wait() and are not handled by watch() yet
+        self.pending_events = []
+        # NOTE: True if a directory could not be watched (e.g. fs.inotify.max_user_watches is reached),
+        # then the files are polled as FileWatcher
+        self.polling = False
+
+    def _match(self, path):
+        rel_path = os.path.relpath(path, self.root or '.')
+        return _match_parts(self.patterns, rel_path.split(os.sep))
+
+    def _add_watch(self, directory):
+        if self.polling:
+            return
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(directory or '.'), self.WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+            return
+        error = ctypes.get_errno()
+        if error in (errno.ENOENT, errno.ENOTDIR):
+            # NOTE: the directory was removed (or replaced) after it was listed
+            return
+        print(f'[WARN] inotify_add_watch failed at {directory or "."}, fallback to polling: '
+              f'{os.strerror(error)}')
+        self.polling = True
+        self.pending_events = []
+        self.close()
+
+    def _add_watch_tree(self, directory):
+        files = []
+        for dirpath, dirnames, filenames in os.walk(directory or '.'):
+            if not directory:
+                dirpath = '' if dirpath == '.' else dirpath.removeprefix('./')
+            self._add_watch(dirpath)
+            files += [os.path.join(dirpath, filename)
+                      for filename in filenames]
+        return files
+
+    def _read_events(self):
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(
+                    buf, offset)
+                offset += self.EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def _relevant(self, wd, mask, name):
+        # NOTE: the events of the files which do not match the pattern (e.g. the appends to the data files
+        # next to the decl files) are dropped, the events of the directories are kept for the watches
+        if mask & (self.IN_Q_OVERFLOW | self.IN_IGNORED | self.IN_ISDIR):
+            return True
+        directory = self.watches.get(wd)
+        return directory is not None and bool(name) and self._match(os.path.join(directory, name))
+
+    def _fetch_events(self):
+        self.pending_events += [event for event in self._read_events() if self._relevant(*event)]
+
+    def watch(self):
+        if self.polling:
+            return super().watch()
+        if self.rescan:
+            # NOTE: the first call or the event queue was overflowed
+            self.rescan = False
+            self.pending_events = []
+            for wd in list(self.watches):
+                self.libc.inotify_rm_watch(self.fd, wd)
+            self.watches = {}
+            self._add_watch_tree(self.root)
+            return super().watch()
+
+        self._fetch_events()
+        events, self.pending_events = self.pending_events, []
+        current_mod_times = dict(self.previous_mod_times)
+        changed_files = set()
+        for wd, mask, name in events:
+            if mask & self.IN_Q_OVERFLOW:
+                self.rescan = True
+                return self.watch()
+            directory = self.watches.get(wd)
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed_files.update(self._add_watch_tree(path))
+                elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    prefix = path + os.sep
+                    changed_files.update(
+                        file for file in current_mod_times if file.startswith(prefix))
+                    for moved_wd, moved_directory in list(self.watches.items()):
+                        if moved_directory == path or moved_directory.startswith(prefix):
+                            self.libc.inotify_rm_watch(self.fd, moved_wd)
+                            self.watches.pop(moved_wd)
+                continue
+            if mask & self.IN_CREATE:
+                # NOTE: wait for IN_CLOSE_WRITE
+                continue
+            changed_files.add(path)
+
+        for file in changed_files:
+            if not self._match(file):
+                continue
+            try:
+                current_mod_times[file] = os.path.getmtime(file)
+            except FileNotFoundError:
+                current_mod_times.pop(file, None)
+        current_mod_times = dict(sorted(current_mod_times.items()))
+        changes = self._compare_file_dicts(
+            self.previous_mod_times, current_mod_times)
+        self.previous_mod_times = current_mod_times
+        return changes
+
+    async def wait(self, timeout):
+        # NOTE: return as soon as an event of the watched files arrives instead of sleeping for the whole interval
+        if self.polling:
+            await super().wait(timeout)
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._fetch_events()
+        while not self.pending_events:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            readable = loop.create_future()
+            loop.add_reader(self.fd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, remaining)
+            except asyncio.TimeoutError:
+                return
+            finally:
+                loop.remove_reader(self.fd)
+            self._fetch_events()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_file_watcher(pattern, backend=None):
+    # NOTE: 'inotify' or 'poll', inotify is used if it is available
+    if backend is None:
+        backend = os.getenv("FILE_WATCHER_BACKEND", "inotify")
+    if backend == 'inotify' and sys.platform.startswith('linux'):
+        try:
+            return InotifyFileWatcher(pattern)
+        except (OSError, AttributeError) as e:
+            print(f'[WARN] inotify is not available, fallback to polling: {e}')
+    return FileWatcher(pattern)
+
 
 def main():
     pattern = '**/*.json'
-    file_watcher = FileWatcher(pattern)
+    file_watcher = create_file_watcher(pattern)
     while True:
         files = file_watcher.watch()
         print(files)
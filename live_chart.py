@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import threading
+import uuid
+
+import plotly
+import plotly.io
+import plotly.offline
+import plotly.graph_objects as go
+import streamlit as st
+import streamlit.components.v1
+import streamlit.components.v2
+
+# NOTE: the number of the points per trace which are kept on the client
+DEFAULT_MAX_POINTS = 10000
+
+# NOTE: the figure is kept on the client (window.__liveCharts) over the renders,
+# a render replaces the element, so the plot is moved into the new element and only the new points are applied.
+# The messages are
+#   reset: {figure} -> Plotly.react
+#   delta: {extend, indices} -> Plotly.extendTraces (based on the previous message 'base')
+# If a delta is not based on the message which was applied last (e.g. a render was skipped),
+# the client sends 'resync' (LiveChart.resync, it also reruns the script) and the next render sends the figure.
+_JS = """
+function loadPlotly(src) {
+  if (window.Plotly) {
+    return Promise.resolve(window.Plotly);
+  }
+  if (!window.__livePlotly) {
+    window.__livePlotly = new Promise((resolve, reject) => {
+      const script = document.createElement('script');
+      script.src = new URL(src, window.location.href).href;
+      script.onload = () => resolve(window.Plotly);
+      script.onerror = reject;
+      document.head.appendChild(script);
+    });
+  }
+  return window.__livePlotly;
+}
+
+export default function(component) {
+  const { data, parentElement, setTriggerValue } = component;
+  const message = typeof data === 'string' ? JSON.parse(data) : data;
+  const charts = window.__liveCharts || (window.__liveCharts = {});
+  let chart = charts[message.id];
+  if (!chart) {
+    chart = charts[message.id] = {
+      div: document.createElement('div'), token: null, seq: null, queue: Promise.resolve() };
+  }
+  parentElement.appendChild(chart.div);
+  chart.queue = chart.queue.then(() => loadPlotly(message.plotly_js)).then((Plotly) => {
+    if (chart.token === message.token && chart.seq === message.seq) {
+      return;
+    }
+    if (message.figure) {
+      chart.token = message.token;
+      chart.seq = message.seq;
+      return Plotly.react(chart.div, message.figure.data, message.figure.layout, { responsive: true });
+    }
+    if (chart.token !== message.token || chart.seq !== message.base) {
+      setTriggerValue('resync', message.seq);
+      return;
+    }
+    chart.seq = message.seq;
+    if (message.indices.length > 0) {
+      return Plotly.extendTraces(chart.div, message.extend, message.indices, message.max_points);
+    }
+  }).catch((e) => console.error('live_chart', e));
+}
+"""
+
+_lock = threading.Lock()
+_component = None
+_plotly_js = None
+
+
+def _plotly_js_dir():
+    # NOTE: plotly.js of the installed plotly, it is served as a static file of a component
+    # so the browser loads it once instead of at each render
+    dirpath = os.path.join(tempfile.gettempdir(), f'live-chart-plotly-{plotly.__version__}')
+    filepath = os.path.join(dirpath, 'plotly.min.js')
+    if not os.path.exists(filepath):
+        os.makedirs(dirpath, exist_ok=True)
+        tmp_filepath = f'{filepath}.{os.getpid()}'
+        with open(tmp_filepath, mode='w') as f:
+            f.write(plotly.offline.get_plotlyjs())
+        os.replace(tmp_filepath, filepath)
+    return dirpath
+
+
+def _get_component():
+    global _component, _plotly_js
+    with _lock:
+        if _component is None:
+            assets = st.components.v1.declare_component(
+                'live_chart_assets', path=_plotly_js_dir())
+            _plotly_js = f'component/{assets.name}/plotly.min.js'
+            # NOTE: not isolated, the styles of plotly.js are added to the document
+            _component = st.components.v2.component(
+                'live_chart', js=_JS, isolate_styles=False)
+        return _component, _plotly_js
+
+
+def _trim(trace, max_points):
+    # NOTE: keep the last max_points of the per point arrays
+    if trace.x is None or len(trace.x) <= max_points:
+        return
+    n = len(trace.x)
+    for name in trace.to_plotly_json():
+        values = trace[name]
+        if hasattr(values, '__len__') and not isinstance(values, str) and len(values) == n:
+            trace[name] = values[n - max_points:]
+
+
+class LiveChart:
+    # NOTE: the figure of a component on the client, one per component and script run
+    # key: the id of the figure on the client (e.g. the decl file path)
+    def __init__(self, key, max_points=DEFAULT_MAX_POINTS):
+        self.key = key
+        self.max_points = max_points
+        # NOTE: the messages of a script run, the client drops the deltas of the other script runs
+        self.token = uuid.uuid4().hex
+        self.seq = 0
+        self.names = None
+        self.types = None
+        self.stream_key = None
+        self.end = None
+
+    def _extend(self, plan, df):
+        # NOTE: the figure stages are run only for the appended rows
+        fig = plan.run_figure(df)
+        if fig is None:
+            return None
+        names = [trace.name for trace in fig.data]
+        if names == self.names:
+            indices = list(range(len(names)))
+        elif len(set(names)) == len(names) and \
+                len(set(self.names)) == len(self.names) and set(names) <= set(self.names):
+            indices = [self.names.index(name) for name in names]
+        else:
+            # NOTE: a new trace (e.g. a new group of px color)
+            return None
+        if any(trace.x is None or trace.y is None for trace in fig.data):
+            return None
+        return {
+            'extend': {
+                'x': [trace.x for trace in fig.data],
+                'y': [trace.y for trace in fig.data],
+            },
+            'indices': indices,
+        }
+
+    def update(self, plan, df, fig, stream=None):
+        # NOTE: returns the message of a render
+        # df: the output of plan.run, stream: the StreamPosition of df (None: not a stream)
+        end = None if stream is None else stream.begin + len(df.index)
+        message = None
+        types = [trace.type for trace in fig.data]
+        # NOTE: the trace types are changed by the render mode (e.g. scatter -> scattergl over the threshold)
+        if stream is not None and not plan.reduces_rows and self.names is not None and \
+                types == self.types and stream.key == self.stream_key and stream.begin <= self.end <= end:
+            if end == self.end:
+                message = {'extend': {'x': [], 'y': []}, 'indices': []}
+            else:
+                message = self._extend(plan, df.iloc[len(df.index) - (end - self.end):])
+        if message is None:
+            figure = go.Figure(fig)
+            for trace in figure.data:
+                _trim(trace, self.max_points)
+            message = {'figure': figure.to_plotly_json()}
+            self.names = [trace.name for trace in fig.data]
+            self.types = types
+        self.stream_key = None if stream is None else stream.key
+        self.end = end
+        message.update({
+            'id': self.key,
+            'token': self.token,
+            'base': self.seq,
+            'seq': self.seq + 1,
+            'max_points': self.max_points,
+        })
+        self.seq += 1
+        return message
+
+    def resync(self):
+        # NOTE: called when the client could not apply a delta, the next render sends the whole figure
+        self.names = None
+
+    def render(self, plan, df, fig, stream=None):
+        component, plotly_js = _get_component()
+        message = self.update(plan, df, fig, stream)
+        message['plotly_js'] = plotly_js
+        component(data=plotly.io.json.to_json_plotly(message),
+                  on_resync_change=self.resync)
+
+
+def create_live_chart(decl, key):
+    # NOTE: "live-chart": true or {"max-points": N} in the decl
+    options = decl.get('live-chart')
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        options = {}
+    return LiveChart(key, options.get('max-points', DEFAULT_MAX_POINTS))
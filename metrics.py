@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import contextlib
+import http.server
+import os
+import threading
+import time
+
+import pandas as pd
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+SUMMARY = 'summary'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, **extra):
+    labels = {**dict(labels), **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Summary:
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.last = value
+
+
+class MetricsRegistry:
+    # NOTE: the counters and timers of the process (the data sources are shared by all sessions)
+    # name -> (type, help), (name, labels) -> value or Summary
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.values = {}
+
+    def _key(self, name, kind, labels):
+        if name not in self.descriptions:
+            self.descriptions[name] = (kind, '')
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, kind, help_text):
+        with self.lock:
+            self.descriptions[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            key = self._key(name, COUNTER, labels)
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[self._key(name, GAUGE, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            key = self._key(name, SUMMARY, labels)
+            if key not in self.values:
+                self.values[key] = Summary()
+            self.values[key].observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def to_dataframe(self):
+        # NOTE: one row per metric for the diagnostics panel
+        rows = []
+        with self.lock:
+            for (name, labels), value in sorted(self.values.items()):
+                row = {'name': name, 'labels': ','.join(f'{k}={v}' for k, v in labels)}
+                if isinstance(value, Summary):
+                    row.update(value=value.last, count=value.count,
+                               mean=value.sum / value.count if value.count else 0.0, max=value.max)
+                else:
+                    row.update(value=value)
+                rows.append(row)
+        return pd.DataFrame(rows, columns=['name', 'labels', 'value', 'count', 'mean', 'max'])
+
+    def to_prometheus(self):
+        # NOTE: the text exposition format of Prometheus
+        lines = []
+        with self.lock:
+            by_name = {}
+            for (name, labels), value in sorted(self.values.items()):
+                by_name.setdefault(name, []).append((labels, value))
+            for name, samples in by_name.items():
+                kind, help_text = self.descriptions[name]
+                if help_text:
+                    lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    if isinstance(value, Summary):
+                        lines.append(f'{name}_count{_format_labels(labels)} {value.count}')
+                        lines.append(f'{name}_sum{_format_labels(labels)} {value.sum:.6f}')
+                    else:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+                if kind == SUMMARY:
+                    lines.append(f'# TYPE {name}_max gauge')
+                    for labels, value in samples:
+                        lines.append(f'{name}_max{_format_labels(labels)} {value.max:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filepath):
+        # NOTE: e.g. for the textfile collector of node_exporter, the file is replaced atomically
+        tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+        with open(tmp_filepath, mode='w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_filepath, filepath)
+
+
+METRICS = MetricsRegistry()
+
+METRICS.describe('dashboard_bytes_read_total', COUNTER, 'bytes read from the data files')
+METRICS.describe('dashboard_rows_ingested_total', COUNTER, 'rows decoded from the data files')
+METRICS.describe('dashboard_decode_seconds', SUMMARY, 'time to decode the lines into a DataFrame')
+METRICS.describe('dashboard_file_watcher_watch_seconds', SUMMARY, 'time of FileWatcher.watch')
+METRICS.describe('dashboard_load_json_data_seconds', SUMMARY,
+                 'time of an iteration of load_json_data (decl files)')
+METRICS.describe('dashboard_stage_seconds', SUMMARY, 'time of a func stage of a decl')
+METRICS.describe('dashboard_figure_seconds', SUMMARY, 'time to serialize and send a figure')
+METRICS.describe('dashboard_render_seconds', SUMMARY, 'time to render a component')
+METRICS.describe('dashboard_queue_lag_seconds', SUMMARY,
+                 'time from a new data version to the start of its render')
+METRICS.describe('dashboard_coalesced_versions_total', COUNTER,
+                 'data versions which were merged into a later render')
+
+_exporter_lock = threading.Lock()
+_exporters = {}
+
+
+def start_prometheus_file_writer(filepath, interval=10.0, registry=METRICS):
+    # NOTE: one writer thread per file and process
+    def run():
+        while True:
+            try:
+                registry.write_prometheus(filepath)
+            except OSError as e:
+                print(f"📒[metrics] failed to write {filepath}: {e}")
+            time.sleep(interval)
+
+    with _exporter_lock:
+        if filepath not in _exporters:
+            _exporters[filepath] = threading.Thread(
+                target=run, name=f'metrics({filepath})', daemon=True)
+            _exporters[filepath].start()
+
+
+def start_prometheus_server(port, registry=METRICS):
+    # NOTE: serves GET /metrics, one server per port and process
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _exporter_lock:
+        if port not in _exporters:
+            server = http.server.ThreadingHTTPServer(('', port), Handler)
+            _exporters[port] = threading.Thread(
+                target=server.serve_forever, name=f'metrics(:{port})', daemon=True)
+            _exporters[port].start()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+import abc
+
+import numpy as np
+import pandas as pd
+
+from data_buffer import unixtime_scale
+
+# NOTE: key identifies an append-only stream of rows (e.g. (source key, generation)),
+# begin is the absolute row number of the first row of the dataframe
+StreamPosition = namedtuple('StreamPosition', ['key', 'begin'])
+
+
+def _float_values(df, column):
+    return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _datetime_seconds(series):
+    # NOTE: unixtime[s] of a datetime64 column (e.g. unixtime[ms] is replaced with the datetime by auto.datetime)
+    if series.dt.tz is not None:
+        series = series.dt.tz_convert(None)
+    values = series.to_numpy(dtype='M8[ns]')
+    seconds = values.view(np.int64) / 1e9
+    seconds[np.isnat(values)] = np.nan
+    return seconds
+
+
+class IncrementalOperator(abc.ABC):
+    # NOTE: extend() is called with the appended rows only and returns the derived columns of those rows,
+    # the state which is needed for the next rows (e.g. the tail of the rolling window) is kept in the operator.
+    @abc.abstractmethod
+    def extend(self, df):
+        raise NotImplementedError
+
+    def finalize(self, df, columns):
+        # NOTE: df is a shallow copy, columns are the derived values of all rows of df
+        for name, values in columns.items():
+            df[name] = values
+        return df
+
+
+class AutoDatetime(IncrementalOperator):
+    # 🌟自動追加のフィールド
+    # The unit of unixtime ([s] or [ms]) is detected once from the first value.
+    def __init__(self, column='unixtime', tz='Asia/Tokyo'):
+        self.column = column
+        self.tz = tz
+        self.ns_per_unit = None
+
+    def extend(self, df):
+        if self.column not in df or not pd.api.types.is_numeric_dtype(df[self.column]):
+            return {}
+        values = _float_values(df, self.column)
+        if self.ns_per_unit is None:
+            valid = values[~np.isnan(values)]
+            if len(valid) == 0:
+                return {}
+            self.ns_per_unit = 1e9 / unixtime_scale(valid[0])
+        nat = np.isnan(values)
+        utc = np.where(nat, 0, values * self.ns_per_unit).astype(np.int64).view('M8[ns]')
+        utc[nat] = np.datetime64('NaT')
+        columns = {'datetime(utc)': utc}
+        if self.ns_per_unit != 1e9:
+            # NOTE: unixtime[ms] is replaced with the datetime
+            columns[self.column] = utc
+        return columns
+
+    def finalize(self, df, columns):
+        if 'datetime(utc)' not in columns:
+            return df
+        utc = pd.Series(columns['datetime(utc)'], index=df.index,
+                        copy=False).dt.tz_localize('UTC')
+        df['datetime(utc)'] = utc
+        df['datetime(jst)'] = utc.dt.tz_convert(self.tz)
+        if self.column in columns:
+            df[self.column] = columns[self.column]
+        return df
+
+
+class RollingOperator(IncrementalOperator):
+    # NOTE: the output of a row depends on the last tail_size input rows
+    def __init__(self, src, dst, tail_size):
+        self.src = src
+        self.dst = dst
+        self.tail_size = tail_size
+        self.tail = np.empty(0)
+
+    @abc.abstractmethod
+    def compute(self, values):
+        raise NotImplementedError
+
+    def extend(self, df):
+        values = np.concatenate([self.tail, _float_values(df, self.src)])
+        output = self.compute(values)[len(self.tail):]
+        if self.tail_size > 0:
+            self.tail = values[-self.tail_size:]
+        return {self.dst: output}
+
+
+# NOTE: 移動平均線
+# dst: optional if None, {src}(MA_{window})
+class MovingAverage(RollingOperator):
+    def __init__(self, src, window=5, dst=None):
+        super().__init__(src, dst or f'{src}(MA_{window})', window - 1)
+        self.window = window
+
+    def compute(self, values):
+        return pd.Series(values).rolling(window=self.window).mean().to_numpy()
+
+
+# dst: optional if None, {src}(diff)
+class Diff(RollingOperator):
+    def __init__(self, src, periods=1, dst=None):
+        super().__init__(src, dst or f'{src}(diff)', periods)
+        self.periods = periods
+
+    def compute(self, values):
+        return pd.Series(values).diff(self.periods).to_numpy()
+
+
+# NOTE: exponentially weighted moving average, same as ewm(adjust=False)
+# dst: optional if None, {src}(EWMA_{span}) or {src}(EWMA_{alpha})
+class EWMA(IncrementalOperator):
+    def __init__(self, src, span=None, alpha=None, dst=None):
+        if (span is None) == (alpha is None):
+            raise ValueError("Required exactly one of 'span' or 'alpha'")
+        self.src = src
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1.0)
+        self.dst = dst or f'{src}(EWMA_{span if span is not None else alpha})'
+        # NOTE: the output at the last non-NaN value and the number of the NaN values after it
+        # (the NaN values decay the weight of the last value as in ewm(ignore_na=False))
+        self.last = np.nan
+        self.gap = 0
+        # NOTE: after this many NaN values the weight of the last value is under the float precision
+        self.max_gap = int(np.log(np.finfo(np.float64).eps) / np.log1p(-self.alpha)) + 1 \
+            if self.alpha < 1.0 else 0
+
+    def extend(self, df):
+        values = _float_values(df, self.src)
+        if np.isnan(self.last):
+            output = pd.Series(values).ewm(
+                alpha=self.alpha, adjust=False).mean().to_numpy()
+        else:
+            gap = min(self.gap, self.max_gap)
+            output = pd.Series(np.concatenate([[self.last], np.full(gap, np.nan), values])).ewm(
+                alpha=self.alpha, adjust=False).mean().to_numpy()[1 + gap:]
+        valid = np.flatnonzero(~np.isnan(values))
+        if len(valid) > 0:
+            self.last = output[valid[-1]]
+            self.gap = len(values) - 1 - valid[-1]
+        else:
+            self.gap += len(values)
+        return {self.dst: output}
+
+
+# NOTE: per second rate of src, time is unixtime[s] or [ms]
+# dst: optional if None, {src}(rate)
+class Rate(IncrementalOperator):
+    def __init__(self, src, time='unixtime', dst=None):
+        self.src = src
+        self.time = time
+        self.dst = dst or f'{src}(rate)'
+        self.scale = None
+        self.last_value = np.nan
+        # NOTE: [s]
+        self.last_time = np.nan
+
+    def _seconds(self, df):
+        if pd.api.types.is_datetime64_any_dtype(df[self.time]):
+            return _datetime_seconds(df[self.time])
+        times = _float_values(df, self.time)
+        if self.scale is None:
+            self.scale = unixtime_scale(times[0])
+        return times / self.scale
+
+    def extend(self, df):
+        values = _float_values(df, self.src)
+        if len(values) == 0:
+            return {self.dst: values}
+        values = np.concatenate([[self.last_value], values])
+        times = np.concatenate([[self.last_time], self._seconds(df)])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            output = np.diff(values) / np.diff(times)
+        self.last_value = values[-1]
+        self.last_time = times[-1]
+        return {self.dst: output}
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import plotly.graph_objects as go
+
+RENDER_MODES = ('auto', 'svg', 'webgl')
+
+# NOTE: the number of the points of the scatter traces in a figure over which WebGL is used in 'auto'
+DEFAULT_WEBGL_THRESHOLD = 1000
+
+
+def _webgl_capable(trace):
+    # NOTE: scattergl does not support the stacked area and the spline
+    return trace.type in ('scatter', 'scattergl') and getattr(trace, 'stackgroup', None) is None and \
+        (trace.line is None or trace.line.shape != 'spline')
+
+
+def count_points(fig):
+    return sum(len(trace.x) if trace.x is not None else len(trace.y) if trace.y is not None else 0
+               for trace in fig.data if trace.type in ('scatter', 'scattergl'))
+
+
+def use_webgl(fig, render_mode='auto', webgl_threshold=DEFAULT_WEBGL_THRESHOLD):
+    if render_mode not in RENDER_MODES:
+        raise ValueError(f"Unsupported render mode '{render_mode}'")
+    if render_mode == 'auto':
+        return count_points(fig) > webgl_threshold
+    return render_mode == 'webgl'
+
+
+def apply_render_mode(fig, render_mode='auto', webgl_threshold=DEFAULT_WEBGL_THRESHOLD):
+    # NOTE: replaces the scatter traces with scattergl (or the reverse) with the same properties
+    # px.line/px.scatter(render_mode='auto') switch each trace by itself, this switches all traces of a figure
+    webgl = use_webgl(fig, render_mode, webgl_threshold)
+    trace_type = 'scattergl' if webgl else 'scatter'
+    if all(trace.type == trace_type for trace in fig.data if _webgl_capable(trace)):
+        return fig
+    trace_class = go.Scattergl if webgl else go.Scatter
+    data = []
+    for trace in fig.data:
+        if _webgl_capable(trace) and trace.type != trace_type:
+            # NOTE: the arrays are passed as they are (to_plotly_json serializes them)
+            props = {name: trace[name] for name in trace.to_plotly_json() if name != 'type'}
+            props = {name: value.to_plotly_json() if hasattr(value, 'to_plotly_json') else value
+                     for name, value in props.items()}
+            # NOTE: the properties which are only for the other type are dropped (e.g. cliponaxis)
+            trace = trace_class(props, skip_invalid=True)
+        data.append(trace)
+    return go.Figure(data=data, layout=fig.layout)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import asyncio
+import time
+
+
+class ComponentState:
+    def __init__(self):
+        self.version = None
+        self.next_time = 0.0
+        self.renders = 0
+        # NOTE: the versions which were not rendered because newer versions came before the next frame
+        self.coalesced = 0
+        self.last_seen_version = None
+        # NOTE: when the first version after the last render was seen (for the queue lag)
+        self.pending_since = None
+
+
+class RenderScheduler:
+    # NOTE: one scheduler per session, decides when each component is re-rendered
+    # A component is re-rendered only when
+    #   * the data version is changed (the versions during the wait are coalesced into one render)
+    #   * the component is visible
+    #   * 1 / max_fps seconds have passed since the last render
+    # and the next render is delayed in proportion to the render time, so the render stays
+    # under max_duty of the time even if a component is slow to render (e.g. a huge figure).
+    def __init__(self, max_fps=2.0, max_duty=0.5, poll_interval=0.01):
+        self.max_fps = max_fps
+        self.max_duty = max_duty
+        self.poll_interval = poll_interval
+        self.components = {}
+
+    def state(self, key):
+        if key not in self.components:
+            self.components[key] = ComponentState()
+        return self.components[key]
+
+    def _ready(self, state, version, visible):
+        if version is None or version == 0 or version == state.version:
+            return False
+        if state.last_seen_version is None:
+            state.pending_since = time.monotonic()
+        elif version != state.last_seen_version:
+            state.coalesced += 1
+        state.last_seen_version = version
+        return visible and time.monotonic() >= state.next_time
+
+    def reset(self, key):
+        # NOTE: a new task of the component (e.g. after a rerun) renders the current version again,
+        # the elements of the previous script run are gone (renders is kept for the unique element keys)
+        state = self.state(key)
+        state.version = None
+        state.last_seen_version = None
+        state.pending_since = None
+        state.next_time = 0.0
+        return state
+
+    async def wait(self, key, get_version, is_visible=lambda: True):
+        # NOTE: returns when the component should be re-rendered
+        state = self.state(key)
+        while not self._ready(state, get_version(), is_visible()):
+            await asyncio.sleep(self.poll_interval)
+
+    def rendered(self, key, version, duration):
+        state = self.state(key)
+        state.version = version
+        state.last_seen_version = None
+        state.renders += 1
+        interval = max(1.0 / self.max_fps, duration * (1.0 / self.max_duty - 1.0))
+        state.next_time = time.monotonic() + interval
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+from data_buffer import unixtime_scale
+from operators import IncrementalOperator, _float_values, _datetime_seconds
+
+# NOTE: bucket widths[s] of the tiers, from fine to coarse
+DEFAULT_TIERS = (1, 10, 60, 600)
+
+
+def _reduce(keys, stats):
+    # NOTE: merge the rows which have the same key, stats: name -> (ufunc, values)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], {name: ufunc.reduceat(values[order], starts)
+                          for name, (ufunc, values) in stats.items()}
+
+
+class RollupTier:
+    # NOTE: count/sum/min/max per bucket of a fixed width, the buckets are sorted by the key (= floor(time / width))
+    def __init__(self, width):
+        self.width = width
+        self.keys = np.empty(0, dtype=np.int64)
+        self.stats = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def extend(self, times, columns):
+        valid = ~np.isnan(times)
+        keys = np.floor(times[valid] / self.width).astype(np.int64)
+        if len(keys) == 0:
+            return
+        stats = {'count': (np.add, np.ones(len(keys), dtype=np.int64))}
+        for name, values in columns.items():
+            values = values[valid]
+            nan = np.isnan(values)
+            stats[f'{name}\0sum'] = (np.add, np.where(nan, 0.0, values))
+            stats[f'{name}\0n'] = (np.add, (~nan).astype(np.int64))
+            stats[f'{name}\0min'] = (np.minimum, np.where(nan, np.inf, values))
+            stats[f'{name}\0max'] = (np.maximum, np.where(nan, -np.inf, values))
+        keys, reduced = _reduce(keys, stats)
+        if len(self.keys) == 0:
+            self.keys, self.stats = keys, reduced
+            return
+        if keys[0] >= self.keys[-1]:
+            # NOTE: fast path, the rows are appended in time order so only the last bucket can be merged
+            stats = {name: (stats[name][0], np.concatenate([values[-1:], reduced[name]]))
+                     for name, values in self.stats.items()}
+            merged_keys, merged = _reduce(
+                np.concatenate([self.keys[-1:], keys]), stats)
+            self.keys = np.concatenate([self.keys[:-1], merged_keys])
+            self.stats = {name: np.concatenate([values[:-1], merged[name]])
+                          for name, values in self.stats.items()}
+            return
+        stats = {name: (stats[name][0], np.concatenate([values, reduced[name]]))
+                 for name, values in self.stats.items()}
+        self.keys, self.stats = _reduce(
+            np.concatenate([self.keys, keys]), stats)
+
+    def evict(self, time):
+        # NOTE: drop the buckets which end before the time
+        n = np.searchsorted(self.keys, np.floor(time / self.width), side='left')
+        if n > 0:
+            self.keys = self.keys[n:]
+            self.stats = {name: values[n:] for name, values in self.stats.items()}
+
+    def to_dataframe(self, x, names, begin=None):
+        n = 0 if begin is None else np.searchsorted(
+            self.keys, np.floor(begin / self.width), side='left')
+        data = {x: self.keys[n:] * float(self.width)}
+        for name in names:
+            count = self.stats[f'{name}\0n'][n:]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                data[name] = self.stats[f'{name}\0sum'][n:] / count
+            data[f'{name}(min)'] = np.where(
+                count > 0, self.stats[f'{name}\0min'][n:], np.nan)
+            data[f'{name}(max)'] = np.where(
+                count > 0, self.stats[f'{name}\0max'][n:], np.nan)
+        data['count'] = self.stats['count'][n:]
+        return pd.DataFrame(data)
+
+
+# NOTE: time bucket rollups of the y columns, the output has one row per bucket
+# x: the time column (unixtime[s] or [ms] or datetime)
+# y: optional if None, all numeric columns
+#   the output has {y}(mean), {y}(min), {y}(max) columns and count
+# tiers: bucket widths[s], the finest tier whose number of buckets in the visible range is <= n_out is used
+# last_seconds: optional if None, the visible range is the whole data, otherwise the last N seconds
+# tier: optional, use the bucket width instead of the automatic choice
+class Resample(IncrementalOperator):
+    def __init__(self, x='unixtime', y=None, tiers=DEFAULT_TIERS, n_out=2000,
+                 last_seconds=None, tier=None, tz='Asia/Tokyo'):
+        self.x = x
+        self.y = [y] if isinstance(y, str) else y
+        self.tiers = [RollupTier(width) for width in sorted(tiers)]
+        self.n_out = n_out
+        self.last_seconds = last_seconds
+        self.tier = tier
+        self.tz = tz
+        self.scale = None
+
+    def _seconds(self, df):
+        if pd.api.types.is_datetime64_any_dtype(df[self.x]):
+            return _datetime_seconds(df[self.x])
+        values = _float_values(df, self.x)
+        if self.scale is None:
+            valid = values[~np.isnan(values)]
+            if len(valid) == 0:
+                return values
+            self.scale = unixtime_scale(valid[0])
+        return values / self.scale
+
+    def extend(self, df):
+        if self.x not in df or len(df.index) == 0:
+            return {}
+        if self.y is None:
+            self.y = [name for name in df.columns
+                      if name not in (self.x, 'index') and pd.api.types.is_numeric_dtype(df[name])]
+        times = self._seconds(df)
+        columns = {name: _float_values(df, name) if name in df else np.full(len(times), np.nan)
+                   for name in self.y}
+        for tier in self.tiers:
+            tier.extend(times, columns)
+        return {}
+
+    def select_tier(self, begin, end):
+        if self.tier is not None:
+            return next((tier for tier in self.tiers if tier.width == self.tier), self.tiers[-1])
+        for tier in self.tiers:
+            if (end - begin) / tier.width <= self.n_out:
+                return tier
+        return self.tiers[-1]
+
+    def finalize(self, df, columns):
+        # NOTE: df is all rows in the buffer, the evicted rows are dropped from the tiers
+        if self.x not in df or len(df.index) == 0 or self.y is None:
+            return df.iloc[0:0]
+        times = self._seconds(df)
+        valid = times[~np.isnan(times)]
+        if len(valid) == 0:
+            return df.iloc[0:0]
+        begin, end = valid[0], valid[-1]
+        for tier in self.tiers:
+            tier.evict(begin)
+        if self.last_seconds is not None:
+            begin = max(begin, end - self.last_seconds)
+        tier = self.select_tier(begin, end)
+        output = tier.to_dataframe(self.x, self.y, begin)
+        utc = pd.to_datetime((output[self.x] * 1e9).astype(np.int64), unit='ns', utc=True)
+        output['datetime(utc)'] = utc
+        output['datetime(jst)'] = utc.dt.tz_convert(self.tz)
+        return output
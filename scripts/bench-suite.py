@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'trace-dashboard'))
+sys.path.insert(0, ROOT)
+
+import aiofiles  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import plotly  # noqa: E402
+
+import top  # noqa: E402
+from bench_generators import generate_jsonl_dicts, generate_jsonl_arrays, generate_top_log, \
+    generate_chrome_trace, generate_decl_tree  # noqa: E402
+from data_source import DataSource  # noqa: E402
+from decl_plan import compile_plan  # noqa: E402
+from file_watcher import FileWatcher, InotifyFileWatcher  # noqa: E402
+from operators import StreamPosition  # noqa: E402
+from trace_events import process_trace_data  # noqa: E402
+
+# NOTE: name -> setup(tmpdir, scale) -> (prepare, run, info)
+# prepare() is not measured and its return value is passed to run()
+# info: {'items': the number of the processed items, 'unit': the name of the items, 'bytes': optional input size}
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def _ingest_setup(filepath, size, items, line_column=None):
+    def prepare():
+        return DataSource(filepath, filepath, line_column=line_column)
+
+    def run(source):
+        # NOTE: the ingest of async_file_load (tail + decode + buffer) without the thread
+        while source._ingest():
+            pass
+        assert len(source.buffer) == items, (len(source.buffer), items)
+        source.tailer.close()
+
+    return prepare, run, {'items': items, 'unit': 'rows', 'bytes': size}
+
+
+@benchmark('ingest.jsonl.dict')
+def bench_ingest_jsonl_dict(tmpdir, scale):
+    rows = int(200000 * scale)
+    filepath = os.path.join(tmpdir, 'dict.jsonl')
+    size = generate_jsonl_dicts(filepath, rows)
+    return _ingest_setup(filepath, size, rows)
+
+
+@benchmark('ingest.jsonl.array')
+def bench_ingest_jsonl_array(tmpdir, scale):
+    lines = int(4000 * scale)
+    filepath = os.path.join(tmpdir, 'array.jsonl')
+    size = generate_jsonl_arrays(filepath, lines, rows_per_line=50)
+    return _ingest_setup(filepath, size, lines * 50, line_column='snapshot')
+
+
+TRANSFORM_DECL = {'funcs': [
+    {'name': 'prepro.MA', 'args': {'src': 'memory_percent', 'window': 5}},
+    {'name': 'prepro.EWMA', 'args': {'src': 'value0', 'span': 10}},
+    {'name': 'prepro.diff', 'args': {'src': 'value1'}},
+    {'name': 'prepro.rate', 'args': {'src': 'value2'}},
+    {'name': 'px.line', 'args': {'x': 'datetime(jst)', 'y': ['memory_percent', 'memory_percent(MA_5)']}},
+    {'name': 'add_scatter', 'args': {'x': 'datetime(jst)', 'y': 'value0(EWMA_10)', 'name': 'EWMA'}},
+]}
+
+
+def _transform_frame(tmpdir, rows):
+    filepath = os.path.join(tmpdir, f'transform-{rows}.jsonl')
+    generate_jsonl_dicts(filepath, rows)
+    return pd.read_json(filepath, lines=True)
+
+
+@benchmark('transform.full')
+def bench_transform_full(tmpdir, scale):
+    # NOTE: the funcs of create_component without the cache (e.g. a static data or a modified decl)
+    rows = int(100000 * scale)
+    df = _transform_frame(tmpdir, rows)
+
+    def run(_):
+        compile_plan(TRANSFORM_DECL).run(df)
+
+    return lambda: None, run, {'items': rows, 'unit': 'rows'}
+
+
+@benchmark('transform.incremental')
+def bench_transform_incremental(tmpdir, scale):
+    # NOTE: the funcs of create_component while rows are appended to a stream (20 renders)
+    rows = int(100000 * scale)
+    step = max(rows // 20, 1)
+    df = _transform_frame(tmpdir, rows)
+
+    def run(plan):
+        for end in range(step, rows + 1, step):
+            plan.run(df.iloc[:end], ('stream', end), StreamPosition('stream', 0))
+
+    return lambda: compile_plan(TRANSFORM_DECL), run, {'items': rows, 'unit': 'rows'}
+
+
+@benchmark('transform.resample')
+def bench_transform_resample(tmpdir, scale):
+    rows = int(200000 * scale)
+    df = _transform_frame(tmpdir, rows)
+    decl = {'funcs': [
+        {'name': 'prepro.resample', 'args': {'y': ['memory_percent', 'value0']}},
+        {'name': 'px.line', 'args': {'x': 'datetime(jst)', 'y': 'memory_percent'}},
+    ]}
+
+    def run(_):
+        compile_plan(decl).run(df)
+
+    return lambda: None, run, {'items': rows, 'unit': 'rows'}
+
+
+@benchmark('figure.to_json')
+def bench_figure_to_json(tmpdir, scale):
+    # NOTE: the serialization of a figure (st.plotly_chart sends the figure as json)
+    rows = int(100000 * scale)
+    _, _, fig = compile_plan(TRANSFORM_DECL).run(_transform_frame(tmpdir, rows))
+
+    def run(_):
+        fig.to_json()
+
+    return lambda: None, run, {'items': rows, 'unit': 'rows'}
+
+
+def _watcher_setup(tmpdir, scale, watcher_class):
+    dirs = int(1000 * scale)
+    root = os.path.join(tmpdir, f'tree-{watcher_class.__name__}')
+    decls = generate_decl_tree(root, dirs, files_per_dir=10)
+    pattern = f'{root}/**/*.decl.json'
+
+    def run(_):
+        # NOTE: the first scan, the idle watches and a watch after some files were updated
+        watcher = watcher_class(pattern)
+        try:
+            assert len(watcher.watch()) == len(decls)
+            for _ in range(10):
+                watcher.watch()
+            for filepath in decls[:10]:
+                with open(filepath, mode='a') as f:
+                    f.write('\n')
+            watcher.watch()
+        finally:
+            watcher.close()
+
+    return lambda: None, run, {'items': dirs * 10, 'unit': 'files'}
+
+
+@benchmark('watcher.poll')
+def bench_watcher_poll(tmpdir, scale):
+    return _watcher_setup(tmpdir, scale, FileWatcher)
+
+
+@benchmark('watcher.inotify')
+def bench_watcher_inotify(tmpdir, scale):
+    if not sys.platform.startswith('linux'):
+        return None
+    return _watcher_setup(tmpdir, scale, InotifyFileWatcher)
+
+
+@benchmark('top.parse_top_output')
+def bench_parse_top_output(tmpdir, scale):
+    snapshots = int(2000 * scale)
+    filepath = os.path.join(tmpdir, 'top.log')
+    size = generate_top_log(filepath, snapshots, processes=50)
+
+    async def parse_all():
+        async with aiofiles.open(filepath, mode='r') as f:
+            n = 0
+            while True:
+                result = await top.parse_top_output(f, base_datetime=datetime(2024, 1, 1))
+                if result.is_err():
+                    raise ValueError(result.err())
+                if not result.ok():
+                    return n
+                n += 1
+
+    def run(_):
+        assert asyncio.run(parse_all()) == snapshots
+
+    return lambda: None, run, {'items': snapshots, 'unit': 'snapshots', 'bytes': size}
+
+
+@benchmark('top.convert_top_log')
+def bench_convert_top_log(tmpdir, scale):
+    snapshots = int(2000 * scale)
+    filepath = os.path.join(tmpdir, 'top-fast.log')
+    size = generate_top_log(filepath, snapshots, processes=50)
+
+    def run(_):
+        result = top.convert_top_log(filepath, os.path.join(tmpdir, 'top-fast.jsonl'))
+        assert result.ok() == snapshots
+
+    return lambda: None, run, {'items': snapshots, 'unit': 'snapshots', 'bytes': size}
+
+
+@benchmark('trace.process_trace_data')
+def bench_process_trace_data(tmpdir, scale):
+    events = int(20000 * scale)
+
+    def run(trace_data):
+        process_trace_data(trace_data)
+
+    # NOTE: process_trace_data modifies the events
+    return lambda: generate_chrome_trace(events), run, {'items': events, 'unit': 'events'}
+
+
+def measure(setup, tmpdir, scale, repeat, memory):
+    prepared = setup(tmpdir, scale)
+    if prepared is None:
+        return None
+    prepare, run, info = prepared
+    seconds = []
+    for _ in range(repeat):
+        arg = prepare()
+        start = time.perf_counter()
+        run(arg)
+        seconds.append(time.perf_counter() - start)
+    result = {
+        **info,
+        'repeat': repeat,
+        'seconds': seconds,
+        'seconds_min': min(seconds),
+        'seconds_median': statistics.median(seconds),
+        'items_per_second': info['items'] / min(seconds),
+    }
+    if 'bytes' in info:
+        result['megabytes_per_second'] = info['bytes'] / min(seconds) / 1e6
+    if memory:
+        # NOTE: a separate run, tracemalloc slows down the allocations
+        arg = prepare()
+        tracemalloc.start()
+        try:
+            run(arg)
+            result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, base_filepath):
+    with open(base_filepath) as f:
+        base = json.load(f)['results']
+    print(f'[📒] compared with {base_filepath} (>1.0: faster/smaller than the base)')
+    for name, result in results.items():
+        if name not in base or base[name]['items'] != result['items']:
+            continue
+        speedup = result['items_per_second'] / base[name]['items_per_second']
+        line = f'{name:>28}: throughput x{speedup:6.2f}'
+        if 'peak_memory_bytes' in result and 'peak_memory_bytes' in base[name]:
+            line += f"  peak memory x{base[name]['peak_memory_bytes'] / result['peak_memory_bytes']:6.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-k', '--filter', default='',
+                        help='run only the benchmarks whose name contains the text')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='scale of the generated data sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc run for the peak memory')
+    parser.add_argument('-o', '--output', default=None,
+                        help='result json file (default: bench-results/{time}-{commit}.json)')
+    parser.add_argument('--compare', default=None,
+                        help='result json file of a base version')
+    parser.add_argument('--list', action='store_true')
+    parser.add_argument('args', nargs='*')  # any length of args is ok
+
+    args, extra_args = parser.parse_known_args()
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print('\n'.join(names))
+        return
+
+    env = environment()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in names:
+            result = measure(BENCHMARKS[name], tmpdir, args.scale,
+                             args.repeat, not args.no_memory)
+            if result is None:
+                print(f'[📒] {name}: skipped')
+                continue
+            results[name] = result
+            line = f"{name:>28}: {result['seconds_min']:8.3f}s " \
+                f"{result['items_per_second']:12.1f} {result['unit']}/s"
+            if 'megabytes_per_second' in result:
+                line += f" {result['megabytes_per_second']:8.2f} MB/s"
+            if 'peak_memory_bytes' in result:
+                line += f" peak {result['peak_memory_bytes'] / 1e6:8.1f} MB"
+            print(line)
+
+    output = args.output
+    if output is None:
+        output = os.path.join(ROOT, 'bench-results',
+                              f"{datetime.now().strftime('%Y%m%d_%H%M%S')}-{env['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, mode='w') as f:
+        json.dump({'environment': env, 'scale': args.scale, 'results': results}, f, indent=2)
+    print(f'[📒] {output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import top  # noqa: E402
+
+
+def generate_top_log(sample_filepath, output_filepath, repeat):
+    # NOTE: repeats the snapshots of a `top -b -d 1` capture
+    with open(sample_filepath, mode='rb') as f:
+        sample = f.read()
+    # NOTE: the snapshots are separated by a blank line
+    sample = sample.rstrip(b'\n') + b'\n\n'
+    with open(output_filepath, mode='wb') as f:
+        for _ in range(repeat):
+            f.write(sample)
+    return sum(1 for line in sample.splitlines() if line.startswith(b'top -'))
+
+
+def report(name, size, snapshots, elapsed):
+    print(f'{name:>6}: {elapsed:8.3f}s {size / elapsed / 1e6:8.2f} MB/s '
+          f'{snapshots / elapsed:10.1f} snapshots/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--sample', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'top-b-n-10-d-1.log'))
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--ext', default='.jsonl', choices=['.jsonl', '.csv'])
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of the processes of the fast path (0: the number of the CPUs)')
+    parser.add_argument('--skip-slow', action='store_true',
+                        help='skip the line by line conversion')
+    parser.add_argument('args', nargs='*')  # any length of args is ok
+
+    args, extra_args = parser.parse_known_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_filepath = os.path.join(tmpdir, 'top.log')
+        snapshots = generate_top_log(args.sample, input_filepath, args.repeat) * args.repeat
+        size = os.path.getsize(input_filepath)
+        print(f'[📒] {size / 1e6:.1f} MB, {snapshots} snapshots')
+
+        output_filepath = os.path.join(tmpdir, 'fast' + args.ext)
+        start = time.perf_counter()
+        result = top.convert_top_log(input_filepath, output_filepath,
+                                     jobs=args.jobs or os.cpu_count())
+        elapsed = time.perf_counter() - start
+        if result.is_err():
+            print(result.err(), file=sys.stderr)
+            sys.exit(1)
+        report('fast', size, result.ok(), elapsed)
+
+        if not args.skip_slow:
+            output_filepath = os.path.join(tmpdir, 'slow' + args.ext)
+            start = time.perf_counter()
+            result = asyncio.run(top.stream_top_output_to_jsonl(
+                input_filepath, output_filepath))
+            elapsed = time.perf_counter() - start
+            if result.is_err():
+                print(result.err(), file=sys.stderr)
+                sys.exit(1)
+            report('slow', size, snapshots, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import random
+
+# NOTE: synthetic data for the benchmarks, the same arguments (and seed) generate the same data
+
+
+def generate_jsonl_dicts(filepath, rows, columns=8, start=1700000000.0, seed=0):
+    # NOTE: one row per line, e.g. the output of data-collector.py
+    rng = random.Random(seed)
+    names = [f'value{i}' for i in range(columns)]
+    with open(filepath, mode='w') as f:
+        for i in range(rows):
+            row = {'unixtime': start + i, 'memory_percent': round(rng.uniform(0, 100), 2)}
+            for name in names:
+                row[name] = round(rng.gauss(0, 1), 6)
+            f.write(json.dumps(row))
+            f.write('\n')
+    return os.path.getsize(filepath)
+
+
+def generate_jsonl_arrays(filepath, lines, rows_per_line=50, start=1700000000.0, seed=0):
+    # NOTE: an array of rows per line, e.g. the output of top.py (one snapshot per line)
+    rng = random.Random(seed)
+    with open(filepath, mode='w') as f:
+        for i in range(lines):
+            f.write(json.dumps([
+                {'unixtime': (start + i) * 1000, 'PID': pid, 'USER': 'root',
+                 'COMMAND': f'command{pid}', '%CPU': round(rng.uniform(0, 100), 1),
+                 '%MEM': round(rng.uniform(0, 10), 1), 'RES': rng.randrange(1 << 20)}
+                for pid in range(1, rows_per_line + 1)]))
+            f.write('\n')
+    return os.path.getsize(filepath)
+
+
+def generate_top_log(filepath, snapshots, processes=50, seed=0):
+    # NOTE: the output of `top -b -d 1`, the snapshots are separated by a blank line
+    rng = random.Random(seed)
+    with open(filepath, mode='w') as f:
+        for i in range(snapshots):
+            hours, rest = divmod(i, 3600)
+            minutes, seconds = divmod(rest, 60)
+            f.write(f'top - {hours % 24:02d}:{minutes:02d}:{seconds:02d} up 22 days,  4:35,  '
+                    f'0 users,  load average: 0.83, 0.37, 0.24\n')
+            f.write(f'Tasks: {processes:3d} total,   1 running, {processes - 1:3d} sleeping,   '
+                    f'0 stopped,   0 zombie\n')
+            f.write('%Cpu(s):  0.0 us,  0.0 sy,  0.0 ni,100.0 id,  0.0 wa,  0.0 hi,  0.0 si,  0.0 st\n')
+            f.write('MiB Mem :   5924.4 total,    241.7 free,    914.8 used,   4767.9 buff/cache\n')
+            f.write('MiB Swap:   1024.0 total,   1021.5 free,      2.5 used.   4408.4 avail Mem \n')
+            f.write('\n')
+            f.write('  PID USER      PR  NI    VIRT    RES    SHR S  %CPU  %MEM     TIME+ COMMAND\n')
+            for pid in range(1, processes + 1):
+                f.write(f'{pid:5d} root      20   0 {rng.randrange(1 << 20):7d} '
+                        f'{rng.randrange(1 << 18):6d} {rng.randrange(1 << 16):6d} S '
+                        f'{rng.uniform(0, 100):5.1f} {rng.uniform(0, 10):5.1f}   '
+                        f'{i // 60}:{i % 60:02d}.{pid % 100:02d} command{pid}\n')
+            f.write('\n')
+    return os.path.getsize(filepath)
+
+
+def generate_chrome_trace(events, threads=4, depth=4, seed=0):
+    # NOTE: nested complete events ('X') sorted by 'ts' per thread, like the PyTorch profiler
+    # (process_trace_data modifies the events, so generate the data for each run)
+    rng = random.Random(seed)
+    trace_events = []
+    per_thread = events // (threads * depth)
+    for thread in range(threads):
+        tid = 1000 + thread
+        ts = 1666382280000000
+        for _ in range(per_thread):
+            dur = 1000 * depth
+            for level in range(depth):
+                trace_events.append({
+                    'ph': 'X', 'cat': 'cpu_op', 'name': f'op{level}:{rng.randrange(8)}',
+                    'pid': 1, 'tid': tid, 'ts': ts + level * 10, 'dur': dur - level * 20,
+                    'args': {}})
+            ts += dur + rng.randrange(100)
+    return {'schemaVersion': 1, 'traceEvents': trace_events}
+
+
+def generate_decl_tree(root, dirs, files_per_dir, decls_per_dir=1):
+    # NOTE: a tree of the dashboard directory, only *.decl.json are watched
+    decl = {'ref-data': {'file': './data.jsonl'},
+            'funcs': [{'name': 'px.line', 'args': {'x': 'unixtime', 'y': 'memory_percent'}}]}
+    filepaths = []
+    for i in range(dirs):
+        dirpath = os.path.join(root, f'group{i % 10}', f'dir{i}')
+        os.makedirs(dirpath, exist_ok=True)
+        for j in range(files_per_dir):
+            if j < decls_per_dir:
+                filepath = os.path.join(dirpath, f'graph{j}.decl.json')
+                with open(filepath, mode='w') as f:
+                    json.dump(decl, f)
+                filepaths.append(filepath)
+            else:
+                with open(os.path.join(dirpath, f'data{j}.jsonl'), mode='w') as f:
+                    f.write('{}\n')
+    return filepaths
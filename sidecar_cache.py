@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+from tailer import TailCheckpoint
+
+HEAD_SIZE = 4096
+
+
+def _head_digest(filepath, size=HEAD_SIZE):
+    with open(filepath, mode='rb') as f:
+        return hashlib.sha1(f.read(size)).hexdigest()
+
+
+class SidecarCache:
+    # NOTE: columnar cache of the decoded rows next to the data file
+    # .{filename}.cache/
+    #   meta.json: checkpoint (inode, offset) of the rows which are in the segments and the file state
+    #   segment-{N}.arrow: Arrow IPC files, one per flush
+    # A cold load memory-maps the segments and only the bytes after the offset have to be decoded.
+    def __init__(self, filepath):
+        self.filepath = filepath
+        dirname, basename = os.path.split(filepath)
+        self.cache_dir = os.path.join(dirname, f'.{basename}.cache')
+        self.meta_path = os.path.join(self.cache_dir, 'meta.json')
+        self.meta = None
+
+    @staticmethod
+    def available():
+        return pa is not None
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_meta(self, meta):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, mode='w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self.meta = meta
+
+    def _validate(self, meta):
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return False
+        if stat.st_ino != meta['inode'] or stat.st_size < meta['offset']:
+            # rotated or truncated
+            return False
+        if stat.st_size == meta['size'] and stat.st_mtime != meta['mtime']:
+            # rewritten with the same size
+            return False
+        return _head_digest(self.filepath, meta['head_size']) == meta['head']
+
+    def load(self, max_rows=None):
+        # NOTE: returns (tables, skipped rows, checkpoint) or None if there is no valid cache
+        # With max_rows, older segments which are not needed are skipped.
+        if pa is None:
+            return None
+        meta = self._read_meta()
+        if meta is None or not self._validate(meta):
+            self.clear()
+            return None
+        segments = meta['segments']
+        skipped_rows = 0
+        if max_rows is not None:
+            rows = 0
+            first = len(segments)
+            while first > 0 and rows < max_rows:
+                first -= 1
+                rows += segments[first]['rows']
+            skipped_rows = sum(segment['rows'] for segment in segments[:first])
+            segments = segments[first:]
+        tables = []
+        for segment in segments:
+            source = pa.memory_map(os.path.join(self.cache_dir, segment['file']))
+            tables.append(pa.ipc.open_file(source).read_all())
+        self.meta = meta
+        return tables, skipped_rows, TailCheckpoint(meta['inode'], meta['offset'])
+
+    def append(self, df, checkpoint):
+        # NOTE: checkpoint is the position just after the last row of df
+        if self.meta is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            meta = {'segments': []}
+        else:
+            meta = dict(self.meta)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        segment_file = f"segment-{len(meta['segments']):05d}.arrow"
+        with pa.OSFile(os.path.join(self.cache_dir, segment_file), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        stat = os.stat(self.filepath)
+        head_size = min(HEAD_SIZE, checkpoint.offset)
+        meta['segments'] = meta['segments'] + \
+            [{'file': segment_file, 'rows': len(df.index)}]
+        meta.update({
+            'inode': checkpoint.inode,
+            'offset': checkpoint.offset,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'head_size': head_size,
+            'head': _head_digest(self.filepath, head_size),
+        })
+        self._write_meta(meta)
+
+    def clear(self):
+        self.meta = None
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+import os
+
+# NOTE: offset is the byte position just after the last complete line which was returned
+TailCheckpoint = namedtuple('TailCheckpoint', ['inode', 'offset'])
+
+
+class FileTailer:
+    # NOTE: max_bytes: the bytes which are read by a read_lines call at most (the rest is read by the next call)
+    def __init__(self, filepath, checkpoint=None, chunk_size=1 << 20, max_bytes=64 << 20):
+        self.filepath = filepath
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.inode = None
+        self.offset = 0
+        if checkpoint is not None:
+            self.inode, self.offset = checkpoint
+        self.f = None
+        self.remainder = b''
+
+    def checkpoint(self):
+        return TailCheckpoint(self.inode, self.offset)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def _reset(self):
+        self.close()
+        self.inode = None
+        self.offset = 0
+        self.remainder = b''
+
+    def _check_rotation(self):
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            # NOTE: the file does not exist yet or it is being rotated
+            return None, False
+        if self.inode is not None and stat.st_ino != self.inode:
+            # rotated: a new file was created at the same path
+            if self.f is not None and os.fstat(self.f.fileno()).st_size > self.f.tell():
+                # NOTE: the lines which were written to the old file before the rotation are read first
+                return stat, False
+            self._reset()
+            return stat, True
+        if stat.st_size < self.offset + len(self.remainder):
+            # truncated
+            self._reset()
+            return stat, True
+        return stat, False
+
+    def read_lines(self):
+        # NOTE: returns (complete lines without '\n', reset flag)
+        # The reset flag is True when the file was truncated or rotated and the lines are
+        # read from the beginning of the new file.
+        stat, reset = self._check_rotation()
+        if stat is None:
+            return [], reset
+        if self.f is None:
+            self.f = open(self.filepath, mode='rb')
+            self.inode = os.fstat(self.f.fileno()).st_ino
+            self.f.seek(self.offset + len(self.remainder))
+        lines = []
+        size = 0
+        while size < self.max_bytes:
+            data = self.f.read(self.chunk_size)
+            if not data:
+                break
+            size += len(data)
+            data = self.remainder + data
+            end = data.rfind(b'\n')
+            if end < 0:
+                self.remainder = data
+                continue
+            self.remainder = data[end + 1:]
+            self.offset += end + 1
+            lines += data[:end].split(b'\n')
+        return lines, reset
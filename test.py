@@ -1,7 +1,41 @@
 #!/usr/bin/env python3
 
+import asyncio
+import base64
+import ctypes
+import errno
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import aiofiles
+
+import numpy as np
+import pandas as pd
 import pytest
+from streamlit.errors import StreamlitAPIException
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
 from dashboard import transform_link_path
+from data_buffer import ColumnarBuffer
+from downsample import downsample_dataframe
+from tailer import FileTailer
+from file_watcher import FileWatcher, FileWatcherConst, InotifyFileWatcher
+from data_source import subscribe_data_source
+from collector_store import CollectorStore
+from sidecar_cache import SidecarCache
+from decoders import CsvDecoder, JsonlDecoder, apply_schema
+from decl_plan import compile_plan, register_stage, PREPRO
+from operators import StreamPosition, EWMA, RollingOperator
+from rollup import Resample
+from render_scheduler import RenderScheduler
+from export import ExportTarget, iter_export
+from live_chart import LiveChart
+from metrics import MetricsRegistry, SUMMARY
+from top import parse_top_output, parse_memory, parse_time_plus, \
+    stream_top_output_to_jsonl, convert_top_log, split_top_log, ProcSampler, PROC_COLUMNS, \
+    pivot_top_n
 
 
 @pytest.mark.parametrize(("filepath", "expected"),
@@ -20,3 +54,648 @@ from dashboard import transform_link_path
 )
 def test_transform_link_path(filepath, expected):
     assert transform_link_path(filepath) == expected
+
+
+def test_columnar_buffer_append():
+    buffer = ColumnarBuffer(chunk_size=2)
+    buffer.append_rows([{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}])
+    buffer.append_rows([{'a': 2.5, 'c': True}])
+    df = buffer.to_dataframe()
+    assert list(df.columns) == ['a', 'b', 'c']
+    assert df['a'].tolist() == [1.0, 2.0, 2.5]
+    assert df['b'].tolist()[:2] == ['x', 'y'] and df['b'][2] is None
+    assert df['c'].tolist()[2] is True
+    assert len(buffer) == 3
+
+
+def test_columnar_buffer_categories():
+    buffer = ColumnarBuffer(chunk_size=2, max_rows=3, category_columns=['k'])
+    buffer.append_rows([{'a': 1, 'k': 'x'}, {'a': 2, 'k': None}])
+    buffer.append_rows([{'a': 3}])
+    buffer.append_rows([{'a': 4, 'k': 'y'}, {'a': 5, 'k': 'x'}])
+    df = buffer.to_dataframe()
+    assert df['k'].dtype == 'category'
+    assert df['k'].astype(object).tolist()[1:] == ['y', 'x'] and pd.isna(df['k'].iloc[0])
+    assert df['a'].tolist() == [3, 4, 5]
+
+
+def test_columnar_buffer_retention():
+    buffer = ColumnarBuffer(chunk_size=4, max_rows=3)
+    for i in range(10):
+        buffer.append_rows([{'unixtime': 100.0 + i, 'v': i}])
+    df = buffer.to_dataframe()
+    assert df['v'].tolist() == [7, 8, 9]
+    assert df.index.tolist() == [7, 8, 9]
+    assert buffer.capacity <= 8
+
+    now = time.time()
+    buffer = ColumnarBuffer(max_age=2.5)
+    buffer.append_rows(
+        [{'unixtime': (now - 9 + t) * 1000, 'v': t} for t in range(10)])
+    assert buffer.to_dataframe()['v'].tolist() == [7, 8, 9]
+    buffer.evict(now=now + 1)
+    assert buffer.to_dataframe()['v'].tolist() == [8, 9]
+
+
+@pytest.mark.parametrize("algorithm", ["lttb", "minmax"])
+def test_downsample_dataframe_keeps_peaks(algorithm):
+    n = 100000
+    df = pd.DataFrame({'x': np.arange(n), 'y': np.sin(np.arange(n) / 100)})
+    df.loc[12345, 'y'] = 10.0
+    df.loc[54321, 'y'] = -10.0
+    downsampled = downsample_dataframe(
+        df, x='x', y='y', n_out=500, algorithm=algorithm)
+    assert len(downsampled.index) <= 502
+    assert downsampled['x'].is_monotonic_increasing
+    assert {0, n - 1, 12345, 54321} <= set(downsampled.index)
+    # the points per trace are capped by n_out with several y columns
+    multi_df = df.assign(**{f'y{i}': np.cos(np.arange(n) / (10 + i)) for i in range(4)})
+    downsampled = downsample_dataframe(
+        multi_df, x='x', n_out=500, algorithm=algorithm)
+    assert len(downsampled.index) <= 502
+    head_df = df.head(10)
+    assert downsample_dataframe(head_df, x='x', n_out=500) is head_df
+
+
+def test_file_tailer(tmp_path):
+    filepath = tmp_path / 'data.jsonl'
+    filepath.write_bytes(b'{"a": 1}\n{"a": 2}\n{"a"')
+    tailer = FileTailer(str(filepath))
+    assert tailer.read_lines() == ([b'{"a": 1}', b'{"a": 2}'], False)
+    with open(filepath, mode='ab') as f:
+        f.write(b': 3}\n')
+    assert tailer.read_lines() == ([b'{"a": 3}'], False)
+    assert tailer.read_lines() == ([], False)
+
+    # resume at the checkpoint
+    checkpoint = tailer.checkpoint()
+    tailer.close()
+    with open(filepath, mode='ab') as f:
+        f.write(b'{"a": 4}\n')
+    tailer = FileTailer(str(filepath), checkpoint=checkpoint)
+    assert tailer.read_lines() == ([b'{"a": 4}'], False)
+
+    # truncated
+    filepath.write_bytes(b'{"b": 1}\n')
+    assert tailer.read_lines() == ([b'{"b": 1}'], True)
+
+    # rotated
+    os.rename(filepath, tmp_path / 'data.jsonl.1')
+    assert tailer.read_lines() == ([], False)
+    filepath.write_bytes(b'{"c": 1}\n{"c": 2}\n')
+    assert tailer.read_lines() == ([b'{"c": 1}', b'{"c": 2}'], True)
+
+    # the rest of the old file is read before the rotated file
+    with open(filepath, mode='ab') as f:
+        f.write(b'{"c": 3}\n')
+    os.rename(filepath, tmp_path / 'data.jsonl.2')
+    filepath.write_bytes(b'{"d": 1}\n')
+    assert tailer.read_lines() == ([b'{"c": 3}'], False)
+    assert tailer.read_lines() == ([b'{"d": 1}'], True)
+
+    # the chunks are read up to max_bytes per call
+    filepath.write_bytes(b''.join(b'{"e": %d}\n' % i for i in range(10)))
+    tailer = FileTailer(str(filepath), chunk_size=4, max_bytes=20)
+    assert tailer.read_lines() == ([b'{"e": 0}', b'{"e": 1}'], False)
+    assert len(tailer.read_lines()[0]) == 2
+    tailer.max_bytes = 1 << 20
+    assert len(tailer.read_lines()[0]) == 6
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is only available on Linux')
+def test_inotify_file_watcher(tmp_path):
+    def statuses(changes):
+        return {file: change['status'] for file, change in changes.items()}
+
+    (tmp_path / 'a.decl.json').write_text('{}')
+    pattern = f'{tmp_path}/**/*.decl.json'
+    file_watcher = InotifyFileWatcher(pattern)
+    poll_file_watcher = FileWatcher(pattern)
+    try:
+        def check():
+            changes = statuses(file_watcher.watch())
+            assert changes == statuses(poll_file_watcher.watch())
+            return changes
+
+        assert check() == {f'{tmp_path}/a.decl.json': FileWatcherConst.NEW}
+        os.makedirs(tmp_path / 'sub')
+        (tmp_path / 'sub' / 'b.decl.json').write_text('{}')
+        (tmp_path / 'sub' / 'b.json').write_text('{}')
+        assert check()[f'{tmp_path}/sub/b.decl.json'] == FileWatcherConst.NEW
+        os.utime(tmp_path / 'a.decl.json', (0, 0))
+        assert check()[f'{tmp_path}/a.decl.json'] == FileWatcherConst.UPDATED
+        os.remove(tmp_path / 'sub' / 'b.decl.json')
+        assert check()[f'{tmp_path}/sub/b.decl.json'] == FileWatcherConst.DELETED
+        assert set(check().values()) == {FileWatcherConst.UNCHANGED}
+
+        # only the events of the watched files end the wait
+        async def wait(write):
+            start = time.monotonic()
+            asyncio.get_running_loop().call_later(0.05, write)
+            await file_watcher.wait(0.5)
+            return time.monotonic() - start
+
+        assert asyncio.run(wait(lambda: (tmp_path / 'data.jsonl').write_text('{}\n'))) >= 0.5
+        assert asyncio.run(wait(lambda: (tmp_path / 'a.decl.json').write_text('{"a": 1}'))) < 0.5
+        assert check()[f'{tmp_path}/a.decl.json'] == FileWatcherConst.UPDATED
+    finally:
+        file_watcher.close()
+
+    # fallback to polling when a directory cannot be watched
+    file_watcher = InotifyFileWatcher(pattern)
+    file_watcher.libc = type('Libc', (), {
+        'inotify_add_watch': lambda *args: (ctypes.set_errno(errno.ENOSPC), -1)[1],
+        'inotify_rm_watch': lambda *args: 0})()
+    try:
+        assert file_watcher.watch()[f'{tmp_path}/a.decl.json']['status'] == FileWatcherConst.NEW
+        assert file_watcher.polling
+        (tmp_path / 'c.decl.json').write_text('{}')
+        assert file_watcher.watch()[f'{tmp_path}/c.decl.json']['status'] == FileWatcherConst.NEW
+    finally:
+        file_watcher.close()
+
+
+def test_data_source_is_shared(tmp_path):
+    filepath = tmp_path / 'data.jsonl'
+    filepath.write_text('{"a": 1}\n[{"a": 2}, {"a": 3}]\n')
+    source = subscribe_data_source(str(filepath), max_rows=2)
+    try:
+        assert subscribe_data_source(
+            str(tmp_path / '.' / 'data.jsonl'), max_rows=2) is source
+        source.unsubscribe()
+        deadline = time.time() + 5.0
+        while source.version == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        version, _, df = source.snapshot()
+        assert version > 0
+        assert df['a'].tolist() == [2, 3]
+    finally:
+        source.unsubscribe()
+        source.stop()
+
+
+def test_data_source_error(tmp_path):
+    def wait_version(source, version):
+        deadline = time.time() + 5.0
+        while source.version <= version and time.time() < deadline:
+            time.sleep(0.01)
+        return source.version
+
+    filepath = tmp_path / 'data.jsonl'
+    filepath.write_text('{"a": 1}\n{"a": \n')
+    source = subscribe_data_source(str(filepath))
+    try:
+        # the failed chunk is reported by a new version
+        version = wait_version(source, 0)
+        assert 'JSONDecodeError' in source.error
+        with open(filepath, mode='a') as f:
+            f.write('{"a": 2}\n')
+        wait_version(source, version)
+        assert source.error is None
+        assert source.snapshot()[2]['a'].tolist() == [2]
+    finally:
+        source.unsubscribe()
+        source.stop()
+
+
+def test_data_source_schema(tmp_path):
+    filepath = tmp_path / 'top.jsonl'
+    filepath.write_text('[{"unixtime": 1, "key": "1 a", "%CPU": "10.0", "RES": "1.5m"},'
+                        ' {"unixtime": 1, "key": "2 b", "%CPU": 2.5, "RES": 10}]\n')
+    source = subscribe_data_source(str(filepath), line_column='snapshot', schema='top')
+    try:
+        deadline = time.time() + 5.0
+        while source.version == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        df = source.snapshot()[2]
+        assert df['%CPU'].tolist() == [10.0, 2.5]
+        assert df['RES'].tolist() == [1536, 10]
+        # the strings are stored as the codes of the categories
+        assert df['key'].dtype == 'category'
+        assert source.buffer.columns['key'].dtype == np.int32
+        assert pivot_top_n(df, '%CPU', n=1).columns.tolist() == ['1 a', 'other']
+    finally:
+        source.unsubscribe()
+        source.stop()
+    with pytest.raises(ValueError):
+        subscribe_data_source(str(filepath), schema='unknown')
+
+
+def test_collector_store(tmp_path):
+    store = CollectorStore(str(tmp_path / 'collector.db'))
+    table = store.table('memory_usage')
+    for i in range(3):
+        table.insert({'unixtime': 100.0 + i, 'memory_percent': 10.0 * i})
+    assert len(table) == 3
+    assert [row['memory_percent'] for row in table.all()] == [0.0, 10.0, 20.0]
+    rows, last_id = table.rows_after(2)
+    assert rows == [{'unixtime': 102.0, 'memory_percent': 20.0}]
+    assert table.rows_after(last_id) == ([], last_id)
+    assert [row['unixtime'] for row in table.since(100.0)] == [101.0, 102.0]
+    assert [row['unixtime'] for row in table.between(100.0, 101.0)] == [100.0, 101.0]
+    # a failed batch is rolled back as a whole
+    with pytest.raises(TypeError):
+        table.insert_multiple([{'unixtime': 103.0}, {'unixtime': 104.0, 'value': {1}}])
+    assert len(table) == 3
+    table.insert_multiple([{'unixtime': 103.0}])
+    assert len(table) == 4
+    with pytest.raises(ValueError):
+        store.table('memory_usage; DROP TABLE x')
+    store.close()
+
+
+def test_data_source_sidecar_cache(tmp_path):
+    def wait_rows(source, n):
+        deadline = time.time() + 5.0
+        while len(source.buffer) < n and time.time() < deadline:
+            time.sleep(0.01)
+        return source.snapshot()[2]
+
+    filepath = tmp_path / 'data.jsonl'
+    filepath.write_text(''.join(f'{{"a": {i}, "b": "x{i}"}}\n' for i in range(5)))
+    source = subscribe_data_source(str(filepath), cache=True)
+    assert wait_rows(source, 5)['a'].tolist() == list(range(5))
+    source.unsubscribe()
+    source.stop()
+    source.thread.join()
+    assert SidecarCache(str(filepath)).load() is not None
+
+    with open(filepath, mode='a') as f:
+        f.write('{"a": 5, "b": "x5"}\n')
+    source = subscribe_data_source(str(filepath), cache=True)
+    # the sources with and without the cache are not shared
+    uncached_source = subscribe_data_source(str(filepath))
+    assert uncached_source is not source
+    uncached_source.unsubscribe()
+    uncached_source.stop()
+    df = wait_rows(source, 6)
+    assert df['a'].tolist() == list(range(6))
+    assert df['b'].tolist()[-1] == 'x5'
+    source.unsubscribe()
+    source.stop()
+    source.thread.join()
+
+    # the cache is invalidated when the file is rewritten
+    filepath.write_text('{"a": 10, "b": "y"}\n')
+    assert SidecarCache(str(filepath)).load() is None
+
+
+def test_csv_decoder():
+    decoder = CsvDecoder()
+    df = decoder.decode([b'PID,COMMAND,%CPU', b'1,tini,0.0', b'7,"a, b",1.5'])
+    assert df.columns.tolist() == ['PID', 'COMMAND', '%CPU']
+    assert df['COMMAND'].tolist() == ['tini', 'a, b']
+    # the schema is reused, a repeated header line is skipped
+    df = decoder.decode([b'PID,COMMAND,%CPU', b'9,top,2'])
+    assert df['%CPU'].dtype == np.float64
+    assert df['PID'].tolist() == [9]
+    # the schema is widened when it does not fit
+    df = decoder.decode([b'10.5,x,3.0'])
+    assert df['PID'].tolist() == [10.5]
+
+
+def test_decl_plan():
+    calls = []
+
+    @register_stage('test.count', PREPRO)
+    def prepro_count(df, tag=None):
+        calls.append(tag)
+        return df
+
+    decl = {'funcs': [
+        {'name': 'test.count', 'args': {'tag': 'a'}},
+        {'name': 'px.line', 'args': {'x': 'x', 'y': 'y'}},
+        {'name': 'add_scatter', 'args': {'x': 'x', 'y': 'y', 'name': 'y2'}},
+        {'name': 'unknown'},
+    ]}
+    plan = compile_plan(decl)
+    assert plan.errors == ["🔥Unknown func.name 'unknown'"]
+    df = pd.DataFrame({'x': [1, 2, 3], 'y': [3, 1, 2]})
+    _, _, fig = plan.run(df, data_key=('test', 1))
+    assert len(fig.data) == 2
+    # the decl is not modified and the cached outputs are reused
+    assert decl['funcs'][2]['args']['x'] == 'x'
+    _, _, cached_fig = plan.run(df, data_key=('test', 1))
+    assert cached_fig is fig
+    assert calls == ['a']
+    plan.run(df, data_key=('test', 2))
+    assert calls == ['a', 'a']
+
+    assert compile_plan({'funcs': [{'name': 'update_layout', 'args': {}}]}).errors \
+        == ["🔥[update_layout] There is no figure before funcs[0]"]
+    # the stages of the dashboard are resolved without the app
+    with open('dashboard/top.decl.json') as f:
+        assert compile_plan(json.load(f)).errors == []
+
+
+def test_incremental_stages():
+    decl = {'funcs': [
+        {'name': 'prepro.MA', 'args': {'src': 'y', 'window': 3}},
+        {'name': 'prepro.EWMA', 'args': {'src': 'y', 'span': 4}},
+        {'name': 'prepro.diff', 'args': {'src': 'y'}},
+        {'name': 'prepro.rate', 'args': {'src': 'y'}},
+    ]}
+    columns = ['y(MA_3)', 'y(EWMA_4)', 'y(diff)', 'y(rate)', 'datetime(jst)']
+    rng = np.random.default_rng(0)
+    full = pd.DataFrame({'unixtime': 1.7e9 + 2.0 * np.arange(100),
+                         'y': rng.random(100)})
+    expected, _, _ = compile_plan(decl).run(full)
+    assert expected['y(rate)'].iloc[1] == pytest.approx(
+        (full['y'][1] - full['y'][0]) / 2.0)
+    plan = compile_plan(decl)
+    # the rows are appended and the head rows are evicted as in a DataSource
+    for version, (begin, end) in enumerate([(0, 10), (0, 40), (15, 70), (30, 100)]):
+        df = full.iloc[begin:end].reset_index(drop=True)
+        df, _, _ = plan.run(df, data_key=('test', version),
+                            stream=StreamPosition(('test', 0), begin))
+        pd.testing.assert_frame_equal(
+            df[columns], expected[columns].iloc[begin:end].reset_index(drop=True))
+    # a session whose snapshot is behind the others reads the shared states
+    states = dict(plan.states)
+    df, _, _ = plan.run(full.iloc[15:70].reset_index(drop=True), data_key=('test', 'behind'),
+                        stream=StreamPosition(('test', 0), 15))
+    pd.testing.assert_frame_equal(
+        df[columns], expected[columns].iloc[15:70].reset_index(drop=True))
+    assert all(plan.states[key] is state for key, state in states.items())
+
+    # unixtime[ms] is replaced with the datetime by auto.datetime before prepro.rate
+    ms = full.assign(unixtime=full['unixtime'] * 1000)
+    df, _, _ = compile_plan(decl).run(ms)
+    np.testing.assert_allclose(df['y(rate)'].to_numpy()[1:], expected['y(rate)'].to_numpy()[1:])
+
+
+def test_incremental_operators_with_nan():
+    values = np.array([np.nan, np.nan, 1.0, 2.0, np.nan, np.nan, 5.0, np.nan, 3.0])
+    expected = pd.Series(values).ewm(span=3, adjust=False).mean().to_numpy()
+    ewma = EWMA('y', span=3)
+    # the batches end with NaN values
+    output = np.concatenate([ewma.extend(pd.DataFrame({'y': values[begin:end]}))['y(EWMA_3)']
+                             for begin, end in [(0, 2), (2, 5), (5, 6), (6, 8), (8, 9)]])
+    np.testing.assert_allclose(output, expected)
+    with pytest.raises(TypeError):
+        RollingOperator('y', 'z', 1)
+
+
+def test_resample():
+    n = 3600
+    full = pd.DataFrame({'unixtime': 1700000040.0 + np.arange(n),
+                         'y': np.arange(n, dtype=float)})
+    resample = Resample(y='y', n_out=100)
+    for begin in range(0, n, 700):
+        resample.extend(full.iloc[begin:begin + 700])
+    # 3600 buckets of 1 s and 360 buckets of 10 s are more than n_out
+    df = resample.finalize(full, {})
+    assert len(df.index) == 60
+    assert df['count'].sum() == n
+    assert df['y'].iloc[0] == pytest.approx(29.5)
+    assert (df['y(min)'].iloc[1], df['y(max)'].iloc[1]) == (60.0, 119.0)
+    # the range is narrowed by last_seconds (from the bucket of the first visible row)
+    resample.last_seconds = 300
+    df = resample.finalize(full.iloc[600:], {})
+    assert len(df.index) == 31
+    assert df['y(min)'].iloc[0] == 3290.0
+    assert len(resample.tiers[2]) == 50
+
+    plan = compile_plan({'funcs': [{'name': 'prepro.resample', 'args': {'y': 'y'}}]})
+    df, data_df, _ = plan.run(full, data_key=('test', 1),
+                              stream=StreamPosition(('test', 0), 0))
+    assert len(df.index) == 360 and len(data_df.index) == n
+
+
+def test_parse_top_output():
+    async def parse():
+        async with aiofiles.open('top-b-n-1.log') as f:
+            return await parse_top_output(f, base_datetime=datetime(2024, 5, 26))
+
+    processes = asyncio.run(parse()).ok()
+    assert processes[2]['PID'] == 842
+    assert processes[2]['RES'] == 122560
+    assert processes[2]['%MEM'] == 2.0
+    assert processes[2]['TIME+'] == pytest.approx(19 * 60 + 52.31)
+    assert parse_memory('1.5g') == 1572864
+    assert parse_time_plus('123:45') == 123 * 60 + 45
+    assert parse_time_plus('12,34') == 12 * 3600 + 34 * 60
+
+    df = apply_schema(pd.DataFrame(
+        {'%CPU': ['10.0', '9.5'], 'VIRT': ['2204', '1.2m'], 'key': ['1 a', '2 b']}), 'top')
+    assert df['%CPU'].tolist() == [10.0, 9.5]
+    assert df['VIRT'].tolist() == [2204, 1228]
+    assert df['key'].dtype == 'category'
+
+
+@pytest.mark.parametrize("ext", ['.jsonl', '.csv'])
+def test_convert_top_log(tmp_path, ext):
+    slow_filepath = str(tmp_path / f'slow{ext}')
+    fast_filepath = str(tmp_path / f'fast{ext}')
+    assert asyncio.run(stream_top_output_to_jsonl(
+        'top-b-n-10-d-1.log', slow_filepath)).is_ok()
+    # small chunks to split the snapshots across the chunks
+    assert convert_top_log('top-b-n-10-d-1.log', fast_filepath,
+                           chunk_size=1000).ok() == 10
+    with open(slow_filepath) as slow, open(fast_filepath) as fast:
+        if ext == '.csv':
+            assert fast.read() == slow.read()
+        else:
+            assert [json.loads(line) for line in fast] == [json.loads(line) for line in slow]
+    # the ranges are converted in parallel and concatenated in order
+    assert len(split_top_log('top-b-n-10-d-1.log', 4)) == 4
+    parallel_filepath = str(tmp_path / f'parallel{ext}')
+    assert convert_top_log('top-b-n-10-d-1.log', parallel_filepath, jobs=2).ok() == 10
+    with open(parallel_filepath) as parallel, open(fast_filepath) as fast:
+        assert parallel.read() == fast.read()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='requires /proc')
+def test_proc_sampler():
+    sampler = ProcSampler(per_thread=True)
+    sampler.sample()
+    records = [record for record in sampler.sample() if record['PID'] == os.getpid()]
+    assert len(records) >= 1
+    assert list(records[0].keys()) == PROC_COLUMNS
+    assert os.getpid() in [record['TID'] for record in records]
+    assert all(record['%CPU'] >= 0.0 for record in records)
+
+
+def test_jsonl_decoder_array_lines():
+    decoder = JsonlDecoder(line_column='snapshot')
+    df = decoder.decode([b'[{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]', b'',
+                         b'[{"a": 3.5, "b": null}]'])
+    assert df['a'].tolist() == [1.0, 2.0, 3.5]
+    assert df['b'].tolist() == ['x', 'y', None]
+    assert df['snapshot'].tolist() == [0, 0, 1]
+    # dict lines and rows with different keys
+    df = decoder.decode([b'{"a": 4}', b'[{"a": 5, "c": true}]'])
+    assert df['snapshot'].tolist() == [2, 3]
+    assert df['c'].isna().tolist() == [True, False]
+    decoder = JsonlDecoder(line_column='snapshot')
+    decoder.resume('unused', df)
+    assert decoder.decode([b'[{"a": 6}]'])['snapshot'].tolist() == [4]
+
+
+def test_pivot_top_n():
+    df = pd.DataFrame({
+        'unixtime': [1, 1, 1, 2, 2],
+        'key': pd.Categorical(['a', 'b', 'c', 'a', 'c']),
+        '%CPU': [10.0, 1.0, 2.0, 20.0, 3.0],
+        '%MEM': [1.0, 9.0, 1.0, 1.0, 1.0],
+    })
+    table = pivot_top_n(df, '%CPU', n=1)
+    assert list(table.columns) == ['a', 'other']
+    assert table['other'].tolist() == [3.0, 3.0]
+    table = pivot_top_n(df, '%MEM', n=2, rank_by='%MEM')
+    assert list(table.columns) == ['b', 'a', 'other']
+    assert np.isnan(table['b'][2])
+
+
+def test_render_scheduler():
+    scheduler = RenderScheduler(max_fps=20.0, max_duty=0.5, poll_interval=0.001)
+    asyncio.run(scheduler.wait('a', lambda: 1))
+    scheduler.rendered('a', 1, duration=0.0)
+    versions = iter([1, 2, 3] + [4] * 1000)
+    start = time.monotonic()
+    asyncio.run(scheduler.wait('a', lambda: next(versions)))
+    # the versions during 1 / max_fps are coalesced into one render
+    assert time.monotonic() - start >= 0.04
+    scheduler.rendered('a', 4, duration=0.1)
+    state = scheduler.state('a')
+    assert (state.renders, state.coalesced) == (2, 2)
+    # the next render is delayed in proportion to the render time
+    assert state.next_time - time.monotonic() > 0.09
+    assert not scheduler._ready(state, 4, True)
+    # a new task (e.g. after a rerun) renders the same version again
+    scheduler.reset('a')
+    asyncio.run(asyncio.wait_for(scheduler.wait('a', lambda: 4), 0.05))
+    assert scheduler.state('a').renders == 2
+
+    async def wait_hidden():
+        await asyncio.wait_for(scheduler.wait('b', lambda: 1, lambda: False), 0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(wait_hidden())
+
+
+@pytest.mark.parametrize(("fmt", "compression"),
+                         [('jsonl', None), ('csv', 'gzip'), ('parquet', None)])
+def test_export(fmt, compression):
+    import gzip
+    import io
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    df = pd.DataFrame({
+        'index': range(5), 'a': range(5),
+        'datetime(utc)': pd.date_range('2024-01-01', periods=5, freq='s', tz='UTC')})
+    export = ExportTarget()
+    export.update(df)
+    # the data is accepted by st.download_button
+    data, _ = convert_data_to_bytes_and_infer_mime(
+        export.export(fmt, compression, last_seconds=2), StreamlitAPIException('unsupported'))
+    if compression == 'gzip':
+        data = gzip.decompress(data)
+    if fmt == 'jsonl':
+        exported = pd.read_json(io.BytesIO(data), lines=True)
+    elif fmt == 'csv':
+        exported = pd.read_csv(io.BytesIO(data))
+    else:
+        exported = pd.read_parquet(io.BytesIO(data))
+    assert exported['a'].tolist() == [2, 3, 4]
+    assert 'index' not in exported
+    # the chunks are serialized one by one
+    assert len(list(iter_export(df, 'csv', chunk_rows=2))) == 4
+
+
+def test_live_chart():
+    plan = compile_plan({'funcs': [
+        {'name': 'px.line', 'args': {'x': 'unixtime', 'y': 'a', 'color': 'key'}}]})
+    live = LiveChart('live', max_points=4)
+
+    def update(n, begin=0, stream_key='a', keys='xy'):
+        df = pd.DataFrame({'unixtime': np.arange(n, dtype=float),
+                           'a': np.arange(n, dtype=float),
+                           'key': [keys[i % len(keys)] for i in range(n)]}).iloc[begin:]
+        stream = StreamPosition(stream_key, begin)
+        df, _, fig = plan.run(df, (stream_key, begin, n), stream)
+        return live.update(plan, df, fig, stream)
+
+    message = update(10)
+    # the points over max_points are trimmed
+    assert [np.frombuffer(base64.b64decode(trace['y']['bdata'])).tolist()
+            for trace in message['figure']['data']] == [[2.0, 4.0, 6.0, 8.0], [3.0, 5.0, 7.0, 9.0]]
+    assert len(live.names) == 2
+    # only the appended rows are sent, even if the head rows were evicted
+    message = update(13, begin=2)
+    assert 'figure' not in message
+    assert (message['base'], message['seq'], message['indices']) == (1, 2, [0, 1])
+    assert [list(x) for x in message['extend']['x']] == [[10.0, 12.0], [11.0]]
+    assert 'figure' not in update(13, begin=2)
+    # the client requested the figure
+    live.resync()
+    assert 'figure' in update(13, begin=2)
+    # a new trace or a new stream resets the figure
+    assert 'figure' in update(15, begin=2, keys='xyz')
+    message = update(5, stream_key='b')
+    assert 'figure' in message and message['seq'] == 6
+
+
+@pytest.mark.parametrize(("decl", "n", "expected"),
+                         [({}, 100, 'scatter'),
+                          ({}, 2000, 'scattergl'),
+                          ({'render-mode': 'webgl'}, 100, 'scattergl'),
+                          ({'render-mode': 'svg'}, 2000, 'scatter'),
+                          ({'webgl-threshold': 10000}, 2000, 'scatter')])
+def test_render_mode(decl, n, expected):
+    plan = compile_plan({**decl, 'funcs': [
+        {'name': 'px.line', 'args': {'x': 'unixtime', 'y': 'a', 'render_mode': 'svg'}},
+        {'name': 'add_scatter', 'args': {'x': 'unixtime', 'y': 'a', 'name': 'b',
+                                         'line': {'dash': 'dash'}}},
+        {'name': 'add_scatter', 'args': {'x': 'unixtime', 'y': 'a', 'stackgroup': 'a'}}]})
+    assert plan.errors == []
+    df = pd.DataFrame({'unixtime': np.arange(n, dtype=float), 'a': np.arange(n, dtype=float)})
+    _, _, fig = plan.run(df)
+    # the stacked trace is always SVG
+    assert [trace.type for trace in fig.data] == [expected, expected, 'scatter']
+    assert (fig.data[1].name, fig.data[1].line.dash, len(fig.data[1].y)) == ('b', 'dash', n)
+
+
+def test_metrics(tmp_path):
+    metrics = MetricsRegistry()
+    metrics.describe('render_seconds', SUMMARY, 'time to render')
+    metrics.inc('rows_total', 3, file='a.jsonl')
+    metrics.inc('rows_total', 2, file='a.jsonl')
+    metrics.set('files', 7)
+    for seconds in (0.5, 1.5):
+        metrics.observe('render_seconds', seconds, decl='x"y')
+    with metrics.time('stage_seconds', stage='px.line'):
+        pass
+    text = metrics.to_prometheus()
+    assert 'rows_total{file="a.jsonl"} 5' in text
+    assert 'files 7' in text
+    assert '# HELP render_seconds time to render' in text
+    assert 'render_seconds_count{decl="x\\"y"} 2' in text
+    assert 'render_seconds_sum{decl="x\\"y"} 2.000000' in text
+    assert 'render_seconds_max{decl="x\\"y"} 1.500000' in text
+    assert 'stage_seconds_count{stage="px.line"} 1' in text
+    df = metrics.to_dataframe()
+    assert df.set_index('name').loc['render_seconds', ['count', 'mean', 'max']].tolist() == [2, 1.0, 1.5]
+    filepath = tmp_path / 'dashboard.prom'
+    metrics.write_prometheus(str(filepath))
+    assert filepath.read_text() == text
+
+
+def test_bench_generators(tmp_path):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trace-dashboard'))
+    from bench_generators import generate_top_log, generate_jsonl_arrays, generate_chrome_trace
+    from trace_events import process_trace_data
+
+    filepath = str(tmp_path / 'top.log')
+    generate_top_log(filepath, 3, processes=4)
+    output_filepath = str(tmp_path / 'top.jsonl')
+    assert convert_top_log(filepath, output_filepath).ok() == 3
+    filepath = str(tmp_path / 'array.jsonl')
+    generate_jsonl_arrays(filepath, 3, rows_per_line=4)
+    with open(filepath, mode='rb') as f:
+        lines = f.read().rstrip(b'\n').split(b'\n')
+    assert len(JsonlDecoder(line_column='snapshot').decode(lines).index) == 12
+    # all nested events are closed
+    assert len(process_trace_data(generate_chrome_trace(64, threads=2, depth=4))) == 64
@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
 
-from datetime import datetime
+from datetime import datetime, timezone
+import concurrent.futures
+import csv
+import json
 import os
+import pwd
 import re
+import shutil
 import subprocess
+import tempfile
 import asyncio
 import argparse
 import sys
+import time
 import traceback
 
+import numpy as np
 import pandas as pd
 from result import Ok, Err, Result, is_ok, is_err
 import aiofiles
@@ -49,6 +57,75 @@ def get_top_time(current_date, line) -> Result[datetime, str]:
                        current_minute, current_second, microsecond=0, tzinfo=None))
 
 
+# NOTE: [KiB], top scales the large values with the suffix (e.g. 1.2g)
+MEMORY_UNITS = {'k': 1, 'm': 1 << 10, 'g': 1 << 20,
+                't': 1 << 30, 'p': 1 << 40, 'e': 1 << 50}
+# NOTE: TIME+ is shown as e.g. 12345h, 12d or 3w when it is too long
+TIME_UNITS = {'h': 3600, 'd': 86400, 'w': 604800}
+TOP_CATEGORY_COLUMNS = ['USER', 'S', 'COMMAND', 'key']
+
+
+def parse_memory(value) -> int:
+    if value.isdigit():
+        return int(value)
+    unit = MEMORY_UNITS.get(value[-1:].lower())
+    if unit is None:
+        return int(value)
+    return int(float(value[:-1]) * unit)
+
+
+def parse_time_plus(value) -> float:
+    # NOTE: [s], minutes:seconds.hundredths or minutes:seconds or hours,minutes
+    unit = TIME_UNITS.get(value[-1:])
+    if unit is not None:
+        return float(value[:-1]) * unit
+    if ',' in value:
+        hours, minutes = value.split(',')
+        return int(hours) * 3600.0 + int(minutes) * 60.0
+    minutes, seconds = value.split(':')
+    return int(minutes) * 60.0 + float(seconds)
+
+
+def parse_priority(value) -> int:
+    # NOTE: 'rt' is the real-time priority
+    return -100 if value == 'rt' else int(value)
+
+
+TOP_PARSERS = {
+    'PID': int,
+    'PR': parse_priority,
+    'NI': int,
+    'VIRT': parse_memory,
+    'RES': parse_memory,
+    'SHR': parse_memory,
+    '%CPU': float,
+    '%MEM': float,
+    'TIME+': parse_time_plus,
+}
+
+
+def parse_top_numbers(df):
+    # NOTE: the numbers are strings in the outputs of the old versions
+    df = df.copy(deep=False)
+    for name, parse in TOP_PARSERS.items():
+        if name in df and not pd.api.types.is_numeric_dtype(df[name]):
+            df[name] = pd.to_numeric(df[name].map(
+                lambda value: parse(value) if isinstance(value, str) else value,
+                na_action='ignore'), errors='coerce')
+    return df
+
+
+def pivot_top_n(df, value, n=10, rank_by='%CPU', other='other'):
+    # NOTE: one column per key (index: unixtime) for the top n keys by the sum of rank_by in df,
+    # the values of the other keys are summed up into the other column
+    ranking = df.groupby('key', observed=True)[rank_by].sum()
+    keys = list(ranking.nlargest(n).index)
+    labels = np.where(df['key'].isin(keys), df['key'].astype(object), other)
+    table = df.pivot_table(index='unixtime', columns=labels,
+                           values=value, aggfunc='sum')
+    return table.reindex(columns=[key for key in keys + [other] if key in table.columns])
+
+
 async def parse_top_output(f, base_datetime=None,
                            follow=False) -> Result[dict, str]:
     process_head = False
@@ -87,41 +164,27 @@ async def parse_top_output(f, base_datetime=None,
             # after the next command, so the exit decision is delayed by one.
             break
 
-        parts = re.split(r'\s+', line.strip())
-        if len(parts) < 12:
+        try:
+            process_info = parse_process_line(line, top_time)
+        except ValueError:
             return Err(f"🔥Failed to parse '{line}'")
-        pid = parts[0]
-        command = ' '.join(parts[11:])
-        process_info = {
-            'PID': pid,
-            'USER': parts[1],
-            'PR': parts[2],
-            'NI': parts[3],
-            'VIRT': parts[4],
-            'RES': parts[5],
-            'SHR': parts[6],
-            'S': parts[7],
-            '%CPU': parts[8],
-            '%MEM': parts[9],
-            'TIME+': parts[10],
-            'COMMAND': command,
-            'unixtime': top_time,
-            'key': f'{pid} {command}',
-        }
         processes.append(process_info)
     return Ok(processes)
 
 
 async def stream_top_output_to_jsonl(
-        input_filepath, output_filepath, follow=False) -> Result[type(()), str]:
+        input_filepath, output_filepath, follow=False, long=False) -> Result[type(()), str]:
     async def write_csv(f_out, df, cnt=0):
         if cnt == 0:
             # write header
-            df_first_row = df.iloc[[0]]
-            await f_out.write(df_first_row.to_csv(header=True, index=False))
+            await f_out.write(df.iloc[0:0].to_csv(header=True, index=False))
         await f_out.write(df.to_csv(header=False, index=False))
 
     async def write_jsonl(f_out, df, cnt=0):
+        if long:
+            # NOTE: one process per line
+            await f_out.write(df.to_json(orient='records', lines=True))
+            return
         await f_out.write(df.to_json(orient='records'))
         await f_out.write('\n')
 
@@ -157,6 +220,352 @@ async def stream_top_output_to_jsonl(
         return Ok(())
 
 
+TOP_COLUMNS = ['PID', 'USER', 'PR', 'NI', 'VIRT', 'RES', 'SHR', 'S',
+               '%CPU', '%MEM', 'TIME+', 'COMMAND', 'unixtime', 'key']
+TOP_HEADER = b'top -'
+
+
+def parse_process_line(line, top_time) -> dict:
+    # NOTE: raises ValueError for an unexpected line
+    parts = line.split()
+    if len(parts) < 12:
+        raise ValueError(line)
+    pid = parts[0]
+    command = ' '.join(parts[11:])
+    return {
+        'PID': int(pid),
+        'USER': parts[1],
+        'PR': parse_priority(parts[2]),
+        'NI': int(parts[3]),
+        'VIRT': parse_memory(parts[4]),
+        'RES': parse_memory(parts[5]),
+        'SHR': parse_memory(parts[6]),
+        'S': parts[7],
+        '%CPU': float(parts[8]),
+        '%MEM': float(parts[9]),
+        'TIME+': parse_time_plus(parts[10]),
+        'COMMAND': command,
+        'unixtime': top_time,
+        'key': f'{pid} {command}',
+    }
+
+
+def parse_top_snapshot(text, base_datetime) -> Result[list, str]:
+    # NOTE: text is one snapshot which starts with 'top -'
+    lines = text.split('\n')
+    top_time_result = get_top_time(base_datetime, lines[0])
+    if top_time_result.is_err():
+        return top_time_result
+    top_time = top_time_result.ok()
+    head = next((i for i, line in enumerate(lines)
+                 if line.lstrip().startswith('PID')), None)
+    if head is None:
+        return Err(f"🔥Failed to find the header line in '{lines[0]}'")
+    processes = []
+    for line in lines[head + 1:]:
+        if not line.strip():
+            break
+        try:
+            processes.append(parse_process_line(line, top_time))
+        except ValueError:
+            return Err(f"🔥Failed to parse '{line.rstrip()}'")
+    return Ok(processes)
+
+
+def iter_top_snapshots(f, chunk_size=1 << 22, size=None):
+    # NOTE: reads big chunks and yields the text of each snapshot
+    # size: optional, reads only the size bytes from the current position
+    buf = b''
+    while size is None or size > 0:
+        chunk = f.read(chunk_size if size is None else min(chunk_size, size))
+        if not chunk:
+            break
+        if size is not None:
+            size -= len(chunk)
+        buf += chunk
+        # NOTE: the last snapshot in buf may be incomplete
+        end = buf.rfind(b'\n' + TOP_HEADER)
+        if end < 0:
+            continue
+        yield from _split_top_snapshots(buf[:end + 1])
+        buf = buf[end + 1:]
+    if buf.strip():
+        yield from _split_top_snapshots(buf)
+
+
+def _split_top_snapshots(data):
+    text = data.decode('utf-8')
+    start = text.find('top -')
+    if start < 0:
+        return
+    for snapshot in text[start:].split('\ntop -'):
+        yield snapshot if snapshot.startswith('top -') else 'top -' + snapshot
+
+
+class TopRecordWriter:
+    # NOTE: writes the records in the same format as stream_top_output_to_jsonl without DataFrames
+    # long: jsonl of one record per line instead of one array of the records per line
+    def __init__(self, f_out, ext, columns=TOP_COLUMNS, header=True, long=False):
+        self.f_out = f_out
+        self.ext = ext
+        self.columns = columns
+        self.header = header
+        self.long = long
+        self.csv_writer = csv.writer(f_out, lineterminator='\n')
+        self.cnt = 0
+        # NOTE: all processes of a snapshot have the same datetime
+        self.last_datetime = None
+        self.last_unixtime = None
+
+    def _json_default(self, value):
+        if isinstance(value, datetime):
+            if value is not self.last_datetime:
+                # NOTE: same as DataFrame.to_json (epoch[ms], the naive datetime is treated as UTC)
+                self.last_datetime = value
+                self.last_unixtime = int(value.replace(
+                    tzinfo=timezone.utc).timestamp() * 1000)
+            return self.last_unixtime
+        raise TypeError(f'{type(value)} is not JSON serializable')
+
+    def write(self, processes):
+        if self.ext == '.jsonl' and self.long:
+            self.f_out.writelines(
+                json.dumps(process, separators=(',', ':'),
+                           default=self._json_default) + '\n'
+                for process in processes)
+        elif self.ext == '.jsonl':
+            self.f_out.write(json.dumps(processes, separators=(',', ':'),
+                                        default=self._json_default))
+            self.f_out.write('\n')
+        else:
+            if self.cnt == 0 and self.header:
+                self.csv_writer.writerow(self.columns)
+            self.csv_writer.writerows(
+                [process[name] for name in self.columns] for process in processes)
+        self.cnt += 1
+
+
+def split_top_log(input_filepath, n) -> list:
+    # NOTE: splits the file into n byte ranges [begin, end) at the 'top -' lines
+    size = os.path.getsize(input_filepath)
+    boundaries = [0]
+    with open(input_filepath, mode='rb') as f:
+        for i in range(1, n):
+            position = max(size * i // n, boundaries[-1])
+            f.seek(position)
+            while True:
+                chunk = f.read(1 << 16)
+                if not chunk:
+                    position = size
+                    break
+                index = chunk.find(b'\n' + TOP_HEADER)
+                if index >= 0:
+                    position += index + 1
+                    break
+                # NOTE: the separator may be across the chunks
+                position += max(len(chunk) - len(TOP_HEADER), 1)
+                f.seek(position)
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _convert_top_range(input_filepath, output_filepath, base_datetime,
+                       begin=0, end=None, chunk_size=1 << 22, header=True,
+                       long=False) -> Result[int, str]:
+    _, ext = os.path.splitext(output_filepath)
+    with open(input_filepath, mode='rb') as f_in, \
+            open(output_filepath, mode='w', buffering=1 << 20) as f_out:
+        f_in.seek(begin)
+        writer = TopRecordWriter(f_out, ext, header=header, long=long)
+        for snapshot in iter_top_snapshots(
+                f_in, chunk_size, None if end is None else end - begin):
+            processes_result = parse_top_snapshot(snapshot, base_datetime)
+            if processes_result.is_err():
+                return processes_result
+            processes = processes_result.ok()
+            if len(processes) == 0:
+                continue
+            writer.write(processes)
+        return Ok(writer.cnt)
+
+
+def convert_top_log(input_filepath, output_filepath,
+                    chunk_size=1 << 22, jobs=1, long=False) -> Result[int, str]:
+    # NOTE: batch mode (no follow), returns the number of the snapshots
+    # jobs > 1: the ranges of the file are converted by a process pool and concatenated in order
+    creation_time_result = get_file_creation_time(input_filepath)
+    if creation_time_result.is_err():
+        return creation_time_result
+    # NOTE: all ranges use the creation time of the whole file as the base date
+    creation_time = creation_time_result.ok()
+    if jobs <= 1:
+        return _convert_top_range(
+            input_filepath, output_filepath, creation_time, chunk_size=chunk_size, long=long)
+    _, ext = os.path.splitext(output_filepath)
+    # NOTE: more ranges than jobs to balance the load
+    ranges = split_top_log(input_filepath, jobs * 4)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        part_filepaths = [os.path.join(tmpdir, f'part-{i:05d}{ext}')
+                          for i in range(len(ranges))]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(
+                _convert_top_range, input_filepath, part_filepath, creation_time,
+                begin, end, chunk_size, header=False, long=long)
+                for part_filepath, (begin, end) in zip(part_filepaths, ranges)]
+            results = [future.result() for future in futures]
+        for result in results:
+            if result.is_err():
+                return result
+        with open(output_filepath, mode='w', buffering=1 << 20) as f_out:
+            if ext != '.jsonl' and any(result.ok() > 0 for result in results):
+                csv.writer(f_out, lineterminator='\n').writerow(TOP_COLUMNS)
+            for part_filepath in part_filepaths:
+                with open(part_filepath) as f_part:
+                    shutil.copyfileobj(f_part, f_out, 1 << 20)
+        return Ok(sum(result.ok() for result in results))
+
+
+PROC_COLUMNS = TOP_COLUMNS + ['TID', 'cgroup']
+
+
+class ProcSampler:
+    # NOTE: samples the same records as `top -b -n 1` from /proc without forking top
+    # %CPU is computed from the tick deltas between the samples (the first sample is the average since the start).
+    # per_thread: one record per thread (/proc/[pid]/task/[tid]/stat), TID is the same as PID otherwise
+    def __init__(self, per_thread=False, proc='/proc'):
+        self.per_thread = per_thread
+        self.proc = proc
+        self.clk_tck = os.sysconf('SC_CLK_TCK')
+        self.page_kib = os.sysconf('SC_PAGE_SIZE') // 1024
+        self.mem_total_kib = self._mem_total_kib()
+        # NOTE: (tid, starttime) -> total ticks at the last sample
+        self.last_ticks = {}
+        self.last_uptime = None
+        self.users = {}
+
+    def _mem_total_kib(self):
+        with open(os.path.join(self.proc, 'meminfo')) as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1])
+        return 0
+
+    def _uptime(self):
+        with open(os.path.join(self.proc, 'uptime')) as f:
+            return float(f.read().split()[0])
+
+    def _user(self, uid):
+        if uid not in self.users:
+            try:
+                self.users[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self.users[uid] = str(uid)
+        return self.users[uid]
+
+    @staticmethod
+    def _read(path):
+        with open(path) as f:
+            return f.read()
+
+    @staticmethod
+    def _cgroup(text):
+        # NOTE: the unified hierarchy (cgroup v2) if exists
+        lines = text.splitlines()
+        for line in lines:
+            if line.startswith('0::'):
+                return line[3:]
+        return lines[-1].split(':', 2)[-1] if lines else ''
+
+    def _stat_paths(self, pid):
+        if not self.per_thread:
+            return [(pid, os.path.join(self.proc, pid, 'stat'))]
+        task_dir = os.path.join(self.proc, pid, 'task')
+        return [(tid, os.path.join(task_dir, tid, 'stat'))
+                for tid in os.listdir(task_dir)]
+
+    def sample(self) -> list:
+        now = datetime.now()
+        uptime = self._uptime()
+        elapsed = None if self.last_uptime is None else uptime - self.last_uptime
+        ticks = {}
+        records = []
+        for pid in os.listdir(self.proc):
+            if not pid.isdigit():
+                continue
+            pid_dir = os.path.join(self.proc, pid)
+            try:
+                user = self._user(os.stat(pid_dir).st_uid)
+                size, resident, shared = self._read(
+                    os.path.join(pid_dir, 'statm')).split()[:3]
+                cgroup = self._cgroup(self._read(os.path.join(pid_dir, 'cgroup')))
+                stats = [(tid, self._read(path)) for tid, path in self._stat_paths(pid)]
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                # NOTE: the process has exited
+                continue
+            for tid, stat in stats:
+                # NOTE: comm may contain spaces and parentheses
+                comm = stat[stat.index('(') + 1:stat.rindex(')')]
+                fields = stat[stat.rindex(')') + 2:].split()
+                total_ticks = int(fields[11]) + int(fields[12])
+                starttime = int(fields[19])
+                ticks[(tid, starttime)] = total_ticks
+                last_ticks = self.last_ticks.get((tid, starttime))
+                if last_ticks is None or not elapsed:
+                    delta_ticks = total_ticks
+                    delta_seconds = uptime - starttime / self.clk_tck
+                else:
+                    delta_ticks = total_ticks - last_ticks
+                    delta_seconds = elapsed
+                cpu = 100.0 * delta_ticks / self.clk_tck / delta_seconds if delta_seconds > 0 else 0.0
+                res = int(resident) * self.page_kib
+                key = f'{pid} {comm}' if not self.per_thread else f'{pid}/{tid} {comm}'
+                records.append({
+                    'PID': int(pid),
+                    'USER': user,
+                    'PR': int(fields[15]),
+                    'NI': int(fields[16]),
+                    'VIRT': int(size) * self.page_kib,
+                    'RES': res,
+                    'SHR': int(shared) * self.page_kib,
+                    'S': fields[0],
+                    '%CPU': round(cpu, 1),
+                    '%MEM': round(100.0 * res / self.mem_total_kib, 1) if self.mem_total_kib else 0.0,
+                    'TIME+': total_ticks / self.clk_tck,
+                    'COMMAND': comm,
+                    'unixtime': now,
+                    'key': key,
+                    'TID': int(tid),
+                    'cgroup': cgroup,
+                })
+        self.last_ticks = ticks
+        self.last_uptime = uptime
+        return records
+
+
+def sample_proc_to_file(output_filepath, interval=1.0, iterations=None,
+                        per_thread=False, long=False) -> Result[int, str]:
+    # NOTE: returns the number of the samples
+    _, ext = os.path.splitext(output_filepath)
+    sampler = ProcSampler(per_thread=per_thread)
+    cnt = 0
+    with open(output_filepath, mode='w') as f_out:
+        writer = TopRecordWriter(f_out, ext, columns=PROC_COLUMNS, long=long)
+        while iterations is None or cnt < iterations:
+            start = time.monotonic()
+            try:
+                writer.write(sampler.sample())
+            except OSError:
+                return Err(f"🔥Failed to sample /proc\n{traceback.format_exc()}")
+            f_out.flush()
+            cnt += 1
+            if iterations is None or cnt < iterations:
+                time.sleep(max(0.0, interval - (time.monotonic() - start)))
+    return Ok(cnt)
+
+
 async def main():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -174,13 +583,47 @@ async def main():
         '--follow',
         action='store_true',
         help='output appended data as the file grows')
+    parser.add_argument(
+        '--fast',
+        action='store_true',
+        help='convert the whole file in the batch mode (ignored with --follow)')
+    parser.add_argument(
+        '--long',
+        action='store_true',
+        help='jsonl of one process per line instead of one array of the processes per line')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='number of the processes of --fast (0: the number of the CPUs)')
+    parser.add_argument(
+        '--proc',
+        action='store_true',
+        help='sample /proc instead of converting the output of top (the input is ignored)')
+    parser.add_argument('-d', '--interval', type=float, default=1.0,
+                        help='sampling interval[s] of --proc')
+    parser.add_argument('-n', '--iterations', type=int, default=None,
+                        help='number of the samples of --proc (default: infinite)')
+    parser.add_argument('-H', '--per-thread', action='store_true',
+                        help='one record per thread with --proc')
     parser.add_argument('args', nargs='*')  # any length of args is ok
 
     args, extra_args = parser.parse_known_args()
 
+    if args.proc:
+        result = sample_proc_to_file(
+            args.output_filepath, interval=args.interval,
+            iterations=args.iterations, per_thread=args.per_thread, long=args.long)
+        return result.map(lambda _: ())
+    if args.fast and not args.follow:
+        result = convert_top_log(
+            args.input_filepath.name, args.output_filepath,
+            jobs=args.jobs or os.cpu_count(), long=args.long)
+        return result.map(lambda _: ())
     result = await stream_top_output_to_jsonl(
         args.input_filepath.name,
-        args.output_filepath, follow=args.follow)
+        args.output_filepath, follow=args.follow, long=args.long)
     return result
 
 
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+from collections import defaultdict
+
+
+def process_trace_data(trace_data):
+    events = trace_data["traceEvents"]
+    event_begin_working_stacks = defaultdict(list)
+    event_end_working_stacks = defaultdict(list)
+    event_stacks = defaultdict(list)
+    depth = defaultdict(int)
+
+    index = 0
+    while True:
+        event = None
+        if index < len(events):
+            event = events[index]
+        working_stack_flag = False
+        for (pid, tid, name), event_end_working_stack in event_end_working_stacks.items():
+            if event is not None and event["tid"] != tid:
+                continue
+            if len(event_end_working_stack) == 0:
+                continue
+            if event is None or event["ts"] > event_end_working_stack[-1]["ts"] + \
+                    event_end_working_stack[-1]["dur"]:
+                event = event_end_working_stack.pop()
+                event["ph"] = "E"
+                event["ts"] = event["ts"] + event["dur"]
+                working_stack_flag = True
+                break
+        if not working_stack_flag:
+            index += 1
+        if event is None:
+            break
+        key = (event["pid"], event["tid"], event["name"])
+        tid = event["tid"]
+        # print(event)
+        if event["ph"] == "B":
+            event_begin_working_stacks[key].append(
+                {"start": event["ts"], "end": None, "depth": depth[tid]})
+            depth[tid] += 1
+        elif event["ph"] == "E":
+            if event_begin_working_stacks[key] and event_begin_working_stacks[key][-1]["end"] is None:
+                event_begin_working_stacks[key][-1]["end"] = event["ts"]
+                event_stacks[key].append(event_begin_working_stacks[key].pop())
+                depth[tid] -= 1
+            else:
+                print(f'[WARN] There is no begin event...: f{key=}')
+        elif event["ph"] == "X":
+            event_begin_working_stacks[key].append(
+                {"start": event["ts"], "end": None, "depth": depth[tid]})
+            event_end_working_stacks[key].append(event)
+            depth[tid] += 1
+        else:
+            print(f'[WARN] Unknown event f{event}')
+            pass
+
+    final_stack = []
+    for (pid, tid, name), events in event_stacks.items():
+        stack = []
+        events.sort(key=lambda x: x["start"])
+        for e in events:
+            if e["end"] is not None:
+                stack.append({
+                    "pid": pid,
+                    "tid": tid,
+                    "name": name,
+                    "start": e["start"],
+                    "end": e["end"],
+                    "duration": e["end"] - e["start"],
+                    "y": -tid * 1000 - e['depth'],  # NOTE: ソートさせるための計算
+                })
+        final_stack.extend(stack)
+
+    return final_stack